@@ -9,6 +9,8 @@ from optparse import OptionParser
 import cmdln
 from collections import namedtuple
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import copy
 from osclib.cache import Cache
 from osclib.comments import CommentAPI
 from osclib.conf import Config
@@ -20,10 +22,12 @@ from osclib.core import request_action_key
 from osclib.core import request_age
 from osclib.memoize import memoize
 from osclib.memoize import memoize_session_reset
+from osclib.PubSubConsumer import PubSubConsumer
 from osclib.sentry import sentry_init
 from osclib.stagingapi import StagingAPI
 import signal
 import datetime
+import json
 import time
 import yaml
 
@@ -41,6 +45,8 @@ from itertools import count
 # In-case not properly initialized via the CommandLineInterface.
 sentry_sdk = sentry_init()
 
+# Number of requests fetched per search when given a list of ids.
+REQUEST_SEARCH_CHUNK = 50
 class PackageLookup(object):
     """ helper class to manage 00Meta/lookup.yml
     """
@@ -88,6 +94,10 @@ class ReviewBot(object):
 
     COMMENT_MARKER_REGEX = re.compile(r'<!-- (?P<bot>[^ ]+) state=(?P<state>[^ ]+)(?: result=(?P<result>[^ ]+))? -->')
 
+    # Set by subclasses that keep all per request state on the instance so
+    # that requests can be checked concurrently by copies of the bot.
+    thread_safe = False
+
     # map of default config entries
     config_defaults = {
             # list of tuples (prefix, apiurl, submitrequestprefix)
@@ -120,6 +130,8 @@ class ReviewBot(object):
         self.request_age_min_default = 0
         self.request_age_min_key = '{}-request-age-min'.format(self.bot_name.lower())
         self.lookup = PackageLookup(self.apiurl)
+        # number of requests to check concurrently if thread_safe
+        self.jobs = 1
 
         self.load_config()
 
@@ -171,13 +183,34 @@ class ReviewBot(object):
         self._review_mode = value
 
     def set_request_ids(self, ids):
-        for rqid in ids:
-            u = osc.core.makeurl(self.apiurl, [ 'request', rqid ], { 'withfullhistory': '1' })
-            r = osc.core.http_GET(u)
-            root = ET.parse(r).getroot()
-            req = osc.core.Request()
-            req.read(root)
-            self.requests.append(req)
+        """
+        Fetch the requests with the given ids, in chunks via search instead
+        of one by one. Returns the ids of requests that were not found.
+        """
+        ids = list(OrderedDict.fromkeys(str(rqid) for rqid in ids))
+        missing = []
+        for i in range(0, len(ids), REQUEST_SEARCH_CHUNK):
+            chunk = ids[i:i + REQUEST_SEARCH_CHUNK]
+            match = ' or '.join("@id='{}'".format(rqid) for rqid in chunk)
+            u = osc.core.makeurl(self.apiurl, [ 'search', 'request' ], { 'match': match, 'withfullhistory': '1' })
+            root = ET.parse(osc.core.http_GET(u)).getroot()
+            found = {}
+            for request in root.findall('request'):
+                found[request.get('id')] = self.request_from_xml(request)
+            for rqid in chunk:
+                if rqid not in found:
+                    self.logger.error('request {} not found'.format(rqid))
+                    missing.append(rqid)
+                    continue
+                self.requests.append(found[rqid])
+
+        return missing
+
+    def request_from_xml(self, root):
+        """Return a new osc Request for a request element."""
+        req = osc.core.Request()
+        req.read(root)
+        return req
 
     # function called before requests are reviewed
     def prepare_review(self):
@@ -190,48 +223,98 @@ class ReviewBot(object):
         self.prepare_review()
         return_value = 0
 
-        for req in self.requests:
-            self.logger.info("checking %s" % req.reqid)
-            self.request = req
-            with sentry_sdk.configure_scope() as scope:
-                scope.set_extra('request.id', self.request.reqid)
-
-            # XXX: this is a hack. Annotating the request with staging_project.
-            # OBS itself should provide an API for that but that's currently not the case
-            # https://github.com/openSUSE/openSUSE-release-tools/pull/2377
-            if not hasattr(req, 'staging_project'):
-                staging_project = None
-                for r in req.reviews:
-                    if r.state == 'new' and r.by_project and ":Staging:" in r.by_project:
-                        staging_project = r.by_project
-                        break
-                setattr(req, 'staging_project', staging_project)
-
-            try:
-                good = self.check_one_request(req)
-            except Exception as e:
-                good = None
+        if self.jobs > 1 and self.thread_safe and len(self.requests) > 1:
+            results = self._check_requests_concurrent()
+        else:
+            results = ((self, req, self._check_request(req)) for req in self.requests)
 
-                import traceback
-                traceback.print_exc()
+        for bot, req, (good, failed) in results:
+            if failed:
                 return_value = 1
 
-                sentry_sdk.capture_exception(e)
-
             if self.review_mode == 'no':
                 good = None
             elif self.review_mode == 'accept':
                 good = True
 
             if good is None:
-                self.logger.info("%s ignored" % req.reqid)
+                bot.logger.info("%s ignored" % req.reqid)
             elif good:
-                self._set_review(req, 'accepted')
+                bot._set_review(req, 'accepted')
             elif self.review_mode != 'accept-onpass':
-                self._set_review(req, 'declined')
+                bot._set_review(req, 'declined')
 
         return return_value
 
+    def _check_request(self, req):
+        """check a single request, returns a tuple of result and whether it failed"""
+        self.logger.info("checking %s" % req.reqid)
+        self.request = req
+        with sentry_sdk.configure_scope() as scope:
+            scope.set_extra('request.id', self.request.reqid)
+
+        # XXX: this is a hack. Annotating the request with staging_project.
+        # OBS itself should provide an API for that but that's currently not the case
+        # https://github.com/openSUSE/openSUSE-release-tools/pull/2377
+        if not hasattr(req, 'staging_project'):
+            staging_project = None
+            for r in req.reviews:
+                if r.state == 'new' and r.by_project and ":Staging:" in r.by_project:
+                    staging_project = r.by_project
+                    break
+            setattr(req, 'staging_project', staging_project)
+
+        try:
+            return self.check_one_request(req), False
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+
+            sentry_sdk.capture_exception(e)
+
+            return None, True
+
+    def _check_requests_concurrent(self):
+        """check requests in a thread pool
+
+        Every request is checked by a shallow copy of the bot so per request
+        state like self.request and self.review_messages is not shared. Log
+        records of each request are buffered and replayed in request order
+        once the request is done so the output reads like a sequential run.
+        Yields the same tuples as the sequential path in check_requests.
+        """
+        def worker(req):
+            # Not registered with logging.getLogger() so it does not outlive
+            # the request. Without parent only the buffer (and the comment
+            # handler of the copy) see the records.
+            logger = logging.Logger('{}.{}'.format(self.logger.name, req.reqid),
+                                    self.logger.getEffectiveLevel())
+            handler = BufferingLogHandler()
+            logger.addHandler(handler)
+            bot = self.thread_copy(logger)
+            return bot, bot._check_request(req), handler
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(worker, req) for req in self.requests]
+            for req, future in zip(self.requests, futures):
+                bot, result, handler = future.result()
+                for record in handler.records:
+                    self.logger.handle(record)
+                # reviews are set from the main thread, in order
+                bot.logger = self.logger
+                yield bot, req, result
+
+    def thread_copy(self, logger):
+        """Return a copy of the bot that checks a request in a worker thread.
+
+        Subclasses copy their helpers here if those hold per request state
+        or log on their own.
+        """
+        bot = copy.copy(self)
+        bot.review_messages = dict(self.review_messages)
+        bot.logger = logger
+        return bot
+
     @memoize(session=True)
     def request_override_check_users(self, project):
         """Determine users allowed to override review in a comment command."""
@@ -631,6 +714,19 @@ class ReviewBot(object):
             print('ERROR in URL %s [%s]' % (url, e))
         return False
 
+    def request_review_open(self, req):
+        """return True if the request waits for a review by the reviewer"""
+        if req.state.name != 'review':
+            return False
+        for review in req.reviews:
+            if review.state != 'new':
+                continue
+            if self.review_user and review.by_user == self.review_user:
+                return True
+            if self.review_group and review.by_group == self.review_group:
+                return True
+        return False
+
     def set_request_ids_search_review(self):
         review = None
         if self.review_user:
@@ -643,9 +739,7 @@ class ReviewBot(object):
         self.requests = []
 
         for request in root.findall('request'):
-            req = osc.core.Request()
-            req.read(request)
-            self.requests.append(req)
+            self.requests.append(self.request_from_xml(request))
 
     # also used by openqabot
     def ids_project(self, project, typename):
@@ -657,9 +751,7 @@ class ReviewBot(object):
         ret = []
 
         for request in root.findall('request'):
-            req = osc.core.Request()
-            req.read(request)
-            ret.append(req)
+            ret.append(self.request_from_xml(request))
         return ret
 
     def set_request_ids_project(self, project, typename):
@@ -833,6 +925,15 @@ class ReviewBot(object):
         return False
 
 
+class BufferingLogHandler(logging.Handler):
+    def __init__(self):
+        super(BufferingLogHandler, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
 class CommentFromLogHandler(logging.Handler):
     def __init__(self, level=logging.INFO):
         super(CommentFromLogHandler, self).__init__(level)
@@ -842,6 +943,87 @@ class CommentFromLogHandler(logging.Handler):
         self.lines.append(record.getMessage())
 
 
+class ReviewBotListener(PubSubConsumer):
+    """
+    Check requests as soon as the bus announces a change instead of polling.
+
+    Request events are collected for a few seconds to check bursts of events
+    for the same request only once. Since events can be missed while not
+    connected a full review sweep is run every reconcile_interval minutes,
+    which also resets the session caches like the polling runner does.
+    """
+
+    # seconds to wait for more events before checking
+    BATCH_DELAY = 10
+
+    def __init__(self, checker, logger, reconcile, reconcile_interval=60):
+        self.checker = checker
+        self.reconcile = reconcile
+        self.reconcile_interval = reconcile_interval
+        self.pending = set()
+        self._batch_timer = None
+
+        amqp_prefix = 'suse' if self.checker.apiurl.endswith('suse.de') else 'opensuse'
+        super().__init__(amqp_prefix, logger)
+
+    def interval(self):
+        return self.reconcile_interval * 60
+
+    def routing_keys(self):
+        return [self._prefix + k for k in [
+            '.obs.request.*',
+            '.obs.request.review_wanted',
+        ]]
+
+    def still_alive(self):
+        # first call happens right after connecting which catches up with
+        # everything that happened before
+        self.logger.info('reconciling all requests in review')
+        memoize_session_reset()
+        try:
+            self.reconcile()
+        except Exception as e:
+            self.logger.exception(e)
+        sentry_sdk.flush()
+
+        super().still_alive()
+
+    def on_message(self, unused_channel, method, properties, body):
+        super().on_message(unused_channel, method, properties, body)
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return
+        if 'number' not in payload:
+            return
+
+        self.pending.add(str(payload['number']))
+        if self._batch_timer is None:
+            self._batch_timer = self._connection.ioloop.call_later(self.BATCH_DELAY, self.check_pending)
+
+    def check_pending(self):
+        self._batch_timer = None
+        ids = sorted(self.pending, key=int)
+        self.pending = set()
+
+        self.checker.requests = []
+        try:
+            self.checker.set_request_ids(ids)
+        except (HTTPError, URLError) as e:
+            # hiccups are handled by the next sweep
+            self.logger.warning('failed to fetch requests {}: {}'.format(', '.join(ids), e))
+            return
+        self.checker.requests = [req for req in self.checker.requests if self.checker.request_review_open(req)]
+        if not self.checker.requests:
+            return
+
+        try:
+            self.checker.check_requests()
+        except Exception as e:
+            self.logger.exception(e)
+
+
 class CommandLineInterface(cmdln.Cmdln):
     def __init__(self, *args, **kwargs):
         cmdln.Cmdln.__init__(self, args, kwargs)
@@ -861,6 +1043,7 @@ class CommandLineInterface(cmdln.Cmdln):
         parser.add_option("--fallback-user", dest='fallback_user', metavar='USER', help="fallback review user")
         parser.add_option("--fallback-group", dest='fallback_group', metavar='GROUP', help="fallback review group")
         parser.add_option('-c', '--config', dest='config', metavar='FILE', help='read config file FILE')
+        parser.add_option('-j', '--jobs', type='int', default=1, help='number of requests to check concurrently if supported by the bot')
 
         return parser
 
@@ -892,6 +1075,8 @@ class CommandLineInterface(cmdln.Cmdln):
         if self.options.fallback_group:
             self.checker.fallback_group = self.options.fallback_group
 
+        self.checker.jobs = self.options.jobs
+
         sentry_sdk = sentry_init(conf.config['apiurl'], {
             'review_bot': self.clazz.__name__,
             'review_user': self.checker.review_user,
@@ -920,10 +1105,12 @@ class CommandLineInterface(cmdln.Cmdln):
         ${cmd_usage}
         ${cmd_option_list}
         """
-        self.checker.set_request_ids(args)
-        return self.checker.check_requests()
+        missing = self.checker.set_request_ids(args)
+        return_value = self.checker.check_requests()
+        return 1 if missing else return_value
 
     @cmdln.option('-n', '--interval', metavar="minutes", type="int", help="periodic interval in minutes")
+    @cmdln.option('--listen', action='store_true', help="check requests when notified by the message bus, --interval sets how often all requests are rechecked (default 60)")
     def do_review(self, subcmd, opts, *args):
         """${cmd_name}: check requests that have the specified user or group as reviewer
 
@@ -937,6 +1124,14 @@ class CommandLineInterface(cmdln.Cmdln):
             self.checker.set_request_ids_search_review()
             return self.checker.check_requests()
 
+        if opts.listen:
+            listener = ReviewBotListener(self.checker, self.logger, work, opts.interval or 60)
+            try:
+                listener.run()
+            except KeyboardInterrupt:
+                listener.stop()
+            return 0
+
         return self.runner(work, opts.interval)
 
     @cmdln.option('-n', '--interval', metavar="minutes", type="int", help="periodic interval in minutes")
@@ -5,6 +5,7 @@ from pprint import pformat, pprint
 from stat import S_ISREG, S_ISLNK
 from tempfile import NamedTemporaryFile
 import cmdln
+import hashlib
 import logging
 import os
 import re
@@ -25,6 +26,8 @@ from urllib.error import HTTPError
 
 import rpm
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import threading
 from osclib.comments import CommentAPI
 
 from abichecker_common import CACHEDIR
@@ -62,7 +65,13 @@ ARCH_WHITELIST = {
 
 # Directory where download binary packages.
 DOWNLOADS = os.path.join(CACHEDIR, 'downloads')
+# size limit of the downloaded binary packages
+DOWNLOADS_SIZE = 8 * 1024 * 1024 * 1024
 UNPACKDIR = os.path.join(CACHEDIR, 'unpacked')
+# abi dumps of libraries keyed by the hash of library and debuginfo
+DUMPCACHE = os.path.join(CACHEDIR, 'dumps')
+# size limit of the dump cache
+DUMPCACHE_SIZE = 4 * 1024 * 1024 * 1024
 
 so_re = re.compile(r'^(?:/usr)?/lib(?:64)?/lib([^/]+)\.so(?:\.[^/]+)?')
 debugpkg_re = re.compile(r'-debug(?:source|info)(?:-(?:32|64)bit)?$')
@@ -74,6 +83,50 @@ comment_marker_re = re.compile(r'<!-- abichecker state=(?P<state>done|seen)(?: r
 Report = namedtuple('Report', ('src_project', 'src_package', 'src_rev', 'dst_project', 'dst_package', 'reports', 'result'))
 # report for a single library
 LibResult = namedtuple('LibResult', ('src_repo', 'src_lib', 'dst_repo', 'dst_lib', 'arch', 'htmlreport', 'result'))
+# outcome of checking one matched repo, merged into the Report
+RepoResult = namedtuple('RepoResult', ('ret', 'text_summary', 'missing_debuginfo', 'libresults', 'overall'))
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        while True:
+            buf = fh.read(1024 * 1024)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+
+def prune_lru(directory, maxsize, keep=()):
+    """ remove least recently modified files below directory until the
+    total size is at most maxsize. Files in keep and temporary files still
+    being written are never removed.
+    """
+    keep = set(keep)
+    files = []
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for fn in filenames:
+            path = os.path.join(dirpath, fn)
+            if fn.endswith('.tmp'):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            total += st.st_size
+            if path not in keep:
+                files.append((st.st_mtime, st.st_size, path))
+
+    for mtime, size, path in sorted(files):
+        if total <= maxsize:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
 
 
 class DistUrlMismatch(Exception):
@@ -148,12 +201,15 @@ class LogToDB(logging.Filter):
     def __init__(self, session):
         self.session = session
         self.request_id = None
+        # records may come from several worker threads
+        self.lock = threading.Lock()
 
     def filter(self, record):
         if self.request_id is not None and record.levelno >= logging.INFO:
             logentry = DB.Log(request_id = self.request_id, line = record.getMessage())
-            self.session.add(logentry)
-            self.session.commit()
+            with self.lock:
+                self.session.add(logentry)
+                self.session.commit()
         return True
 
 
@@ -167,8 +223,8 @@ class ABIChecker(ReviewBot.ReviewBot):
         self.no_review = False
         self.force = False
 
-        self.ts = rpm.TransactionSet()
-        self.ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES)
+        # per thread state, a TransactionSet must not be shared
+        self.local = threading.local()
 
         # reports of source submission
         self.reports = []
@@ -292,122 +348,28 @@ class ABIChecker(ReviewBot.ReviewBot):
             self.reports.append(report)
             return False
 
-        notes = []
         libresults = []
 
         overall = None
 
         missing_debuginfo  = []
 
-        for mr in myrepos:
-            try:
-                dst_libs, dst_libdebug = self.extract(dst_project, dst_package, dst_srcinfo, mr.dstrepo, mr.arch)
-                # nothing to fetch, so no libs
-                if dst_libs is None:
-                    continue
-            except DistUrlMismatch as e:
-                self.logger.error("%s/%s %s/%s: %s"%(dst_project, dst_package, mr.dstrepo, mr.arch, e))
-                if ret == True: # need to check again
-                    ret = None
-                continue
-            except MissingDebugInfo as e:
-                missing_debuginfo.append(str(e))
+        # process the repos in a fixed order so the merged summary is the
+        # same no matter in which order the workers finish
+        myrepos = sorted(myrepos)
+        args = [(mr, os.path.join(UNPACKDIR, str(i)), src_project, src_package, src_srcinfo, dst_project, dst_package, dst_srcinfo) for i, mr in enumerate(myrepos)]
+        for result in self.map(lambda a: self.check_repo(*a), args):
+            # False is sticky, None (need to check again) only overrides True
+            if result.ret == False:
                 ret = False
-                continue
-            except FetchError as e:
-                self.logger.error(e)
-                if ret == True: # need to check again
-                    ret = None
-                continue
-
-            try:
-                src_libs, src_libdebug = self.extract(src_project, src_package, src_srcinfo, mr.srcrepo, mr.arch)
-                if src_libs is None:
-                    if dst_libs:
-                        self.text_summary += "*Warning*: the submission does not contain any libs anymore\n\n"
-                    continue
-            except DistUrlMismatch as e:
-                self.logger.error("%s/%s %s/%s: %s"%(src_project, src_package, mr.srcrepo, mr.arch, e))
-                if ret == True: # need to check again
-                    ret = None
-                continue
-            except MissingDebugInfo as e:
-                missing_debuginfo.append(str(e))
-                ret = False
-                continue
-            except FetchError as e:
-                self.logger.error(e)
-                if ret == True: # need to check again
-                    ret = None
-                continue
-
-            # create reverse index for aliases in the source project
-            src_aliases = dict()
-            for lib in src_libs.keys():
-                for a in src_libs[lib]:
-                    src_aliases.setdefault(a, set()).add(lib)
-
-            # for each library in the destination project check if the same lib
-            # exists in the source project. If not check the aliases (symlinks)
-            # to catch soname changes. Generate pairs of matching libraries.
-            pairs = set()
-            for lib in dst_libs.keys():
-                if lib in src_libs:
-                    pairs.add((lib, lib))
-                else:
-                    self.logger.debug("%s not found in submission, checking aliases", lib)
-                    found = False
-                    for a in dst_libs[lib]:
-                        if a in src_aliases:
-                            for l in src_aliases[a]:
-                                pairs.add((lib, l))
-                                found = True
-                    if found == False:
-                        self.text_summary += "*Warning*: %s no longer packaged\n\n"%lib
-
-            self.logger.debug("to diff: %s", pformat(pairs))
-
-            # for each pair dump and compare the abi
-            for old, new in pairs:
-                # abi dump of old lib
-                old_base = os.path.join(UNPACKDIR, dst_project, dst_package, mr.dstrepo, mr.arch)
-                old_dump = os.path.join(CACHEDIR, 'old.dump')
-                # abi dump of new lib
-                new_base = os.path.join(UNPACKDIR, src_project, src_package, mr.srcrepo, mr.arch)
-                new_dump = os.path.join(CACHEDIR, 'new.dump')
-
-                def cleanup():
-                    if os.path.exists(old_dump):
-                        os.unlink(old_dump)
-                    if os.path.exists(new_dump):
-                        os.unlink(new_dump)
-
-                cleanup()
-
-                # we just need that to pass a name to abi checker
-                m = so_re.match(old)
-                htmlreport = 'report-%s-%s-%s-%s-%s-%08x.html'%(mr.srcrepo, os.path.basename(old), mr.dstrepo, os.path.basename(new), mr.arch, int(time.time()))
-
-                # run abichecker
-                if m \
-                    and self.run_abi_dumper(old_dump, old_base, old, dst_libdebug[old]) \
-                    and self.run_abi_dumper(new_dump, new_base, new, src_libdebug[new]):
-                        reportfn = os.path.join(CACHEDIR, htmlreport)
-                        r = self.run_abi_checker(m.group(1), old_dump, new_dump, reportfn)
-                        if r is not None:
-                            self.logger.debug('report saved to %s, compatible: %d', reportfn, r)
-                            libresults.append(LibResult(mr.srcrepo, os.path.basename(old), mr.dstrepo, os.path.basename(new), mr.arch, htmlreport, r))
-                            if overall is None:
-                                overall = r
-                            elif overall == True and r == False:
-                                overall = r
-                else:
-                    self.logger.error('failed to compare %s <> %s'%(old,new))
-                    self.text_summary += "**Error**: ABI check failed on %s vs %s\n\n"%(old, new)
-                    if ret == True: # need to check again
-                        ret = None
-
-                cleanup()
+            elif result.ret is None and ret == True:
+                ret = None
+            self.text_summary += result.text_summary
+            missing_debuginfo += result.missing_debuginfo
+            libresults += result.libresults
+            if result.overall is not None:
+                if overall is None or (overall == True and result.overall == False):
+                    overall = result.overall
 
         if missing_debuginfo:
             self.text_summary += 'debug information is missing for the following packages, can\'t check:\n<pre>'
@@ -423,6 +385,160 @@ class ABIChecker(ReviewBot.ReviewBot):
 
         return ret
 
+    @property
+    def ts(self):
+        ts = getattr(self.local, 'ts', None)
+        if ts is None:
+            ts = rpm.TransactionSet()
+            ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES)
+            self.local.ts = ts
+        return ts
+
+    def map(self, fn, items):
+        """ apply fn to all items, concurrently if --jobs is set
+
+        The abichecker is not thread safe so requests are still checked one
+        by one, the jobs are used for the repos and libraries instead. Only
+        the outermost call runs concurrently, calls from within a worker are
+        serial so there are never more than jobs threads.
+
+        Returns the results in the order of items.
+        """
+        items = list(items)
+        if self.jobs <= 1 or len(items) <= 1 or getattr(self.local, 'worker', False):
+            return [fn(item) for item in items]
+
+        def run(item):
+            self.local.worker = True
+            try:
+                return fn(item)
+            finally:
+                self.local.worker = False
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return list(executor.map(run, items))
+
+    def check_repo(self, mr, unpackdir, src_project, src_package, src_srcinfo, dst_project, dst_package, dst_srcinfo):
+        """ compare the libraries of one matched repo and arch
+
+        Every match is unpacked in its own unpackdir so matches can be
+        processed concurrently. Returns a RepoResult for merging.
+        """
+        ret = True
+        text_summary = ''
+        missing_debuginfo = []
+
+        try:
+            dst_libs, dst_libdebug = self.extract(dst_project, dst_package, dst_srcinfo, mr.dstrepo, mr.arch, unpackdir)
+            # nothing to fetch, so no libs
+            if dst_libs is None:
+                return RepoResult(ret, text_summary, missing_debuginfo, [], None)
+        except DistUrlMismatch as e:
+            self.logger.error("%s/%s %s/%s: %s"%(dst_project, dst_package, mr.dstrepo, mr.arch, e))
+            return RepoResult(None, text_summary, missing_debuginfo, [], None)
+        except MissingDebugInfo as e:
+            missing_debuginfo.append(str(e))
+            return RepoResult(False, text_summary, missing_debuginfo, [], None)
+        except FetchError as e:
+            self.logger.error(e)
+            return RepoResult(None, text_summary, missing_debuginfo, [], None)
+
+        try:
+            src_libs, src_libdebug = self.extract(src_project, src_package, src_srcinfo, mr.srcrepo, mr.arch, unpackdir)
+            if src_libs is None:
+                if dst_libs:
+                    text_summary += "*Warning*: the submission does not contain any libs anymore\n\n"
+                return RepoResult(ret, text_summary, missing_debuginfo, [], None)
+        except DistUrlMismatch as e:
+            self.logger.error("%s/%s %s/%s: %s"%(src_project, src_package, mr.srcrepo, mr.arch, e))
+            return RepoResult(None, text_summary, missing_debuginfo, [], None)
+        except MissingDebugInfo as e:
+            missing_debuginfo.append(str(e))
+            return RepoResult(False, text_summary, missing_debuginfo, [], None)
+        except FetchError as e:
+            self.logger.error(e)
+            return RepoResult(None, text_summary, missing_debuginfo, [], None)
+
+        # create reverse index for aliases in the source project
+        src_aliases = dict()
+        for lib in src_libs.keys():
+            for a in src_libs[lib]:
+                src_aliases.setdefault(a, set()).add(lib)
+
+        # for each library in the destination project check if the same lib
+        # exists in the source project. If not check the aliases (symlinks)
+        # to catch soname changes. Generate pairs of matching libraries.
+        pairs = set()
+        for lib in sorted(dst_libs.keys()):
+            if lib in src_libs:
+                pairs.add((lib, lib))
+            else:
+                self.logger.debug("%s not found in submission, checking aliases", lib)
+                found = False
+                for a in dst_libs[lib]:
+                    if a in src_aliases:
+                        for l in src_aliases[a]:
+                            pairs.add((lib, l))
+                            found = True
+                if found == False:
+                    text_summary += "*Warning*: %s no longer packaged\n\n"%lib
+
+        self.logger.debug("to diff: %s", pformat(pairs))
+
+        # abi dump of old lib
+        old_base = os.path.join(unpackdir, dst_project, dst_package, mr.dstrepo, mr.arch)
+        # abi dump of new lib
+        new_base = os.path.join(unpackdir, src_project, src_package, mr.srcrepo, mr.arch)
+
+        def check_pair(pair):
+            old, new = pair
+            return self.check_pair(mr, old_base, old, dst_libdebug[old], new_base, new, src_libdebug[new])
+
+        # for each pair dump and compare the abi
+        pairs = sorted(pairs)
+        libresults = []
+        overall = None
+        for (old, new), r in zip(pairs, self.map(check_pair, pairs)):
+            if r is None:
+                self.logger.error('failed to compare %s <> %s'%(old,new))
+                text_summary += "**Error**: ABI check failed on %s vs %s\n\n"%(old, new)
+                if ret == True: # need to check again
+                    ret = None
+                continue
+            libresults.append(r)
+            if overall is None:
+                overall = r.result
+            elif overall == True and r.result == False:
+                overall = r.result
+
+        return RepoResult(ret, text_summary, missing_debuginfo, libresults, overall)
+
+    def check_pair(self, mr, old_base, old, old_debug, new_base, new, new_debug):
+        """ dump and compare the abi of a pair of libraries
+
+        Returns a LibResult or None if the check failed.
+        """
+        # we just need that to pass a name to abi checker
+        m = so_re.match(old)
+        if not m:
+            return None
+
+        old_dump = self.abi_dump(old_base, old, old_debug)
+        if not old_dump:
+            return None
+        new_dump = self.abi_dump(new_base, new, new_debug)
+        if not new_dump:
+            return None
+
+        htmlreport = 'report-%s-%s-%s-%s-%s-%08x.html'%(mr.srcrepo, os.path.basename(old), mr.dstrepo, os.path.basename(new), mr.arch, int(time.time()))
+        reportfn = os.path.join(CACHEDIR, htmlreport)
+        r = self.run_abi_checker(m.group(1), old_dump, new_dump, reportfn)
+        if r is None:
+            return None
+
+        self.logger.debug('report saved to %s, compatible: %d', reportfn, r)
+        return LibResult(mr.srcrepo, os.path.basename(old), mr.dstrepo, os.path.basename(new), mr.arch, htmlreport, r)
+
     def _maintenance_hack(self, dst_project, dst_srcinfo, myrepos):
         pkg = dst_srcinfo.package
         originproject = None
@@ -678,7 +794,47 @@ class ABIChecker(ReviewBot.ReviewBot):
             return False
         return True
 
-    def extract(self, project, package, srcinfo, repo, arch):
+    def abi_dump(self, base, filename, debuglib):
+        """ return the path of the abi dump of a library
+
+        Dumps are kept in DUMPCACHE keyed by the hashes of the library and its
+        debug info, so the libraries of the distribution are only dumped once
+        no matter how many requests are checked against them.
+        """
+        libpath = '/'.join([base, filename])
+        debugpath = '/'.join([base, debuglib])
+        key = hashlib.sha256()
+        key.update(os.path.basename(filename).encode('utf-8'))
+        for path in (libpath, debugpath):
+            try:
+                key.update(file_sha256(path).encode('utf-8'))
+            except IOError as e:
+                self.logger.error("failed to hash %s: %s"%(path, e))
+                return None
+
+        # called concurrently by check_pair workers
+        os.makedirs(DUMPCACHE, exist_ok=True)
+
+        dump = os.path.join(DUMPCACHE, '%s.dump'%key.hexdigest())
+        if os.path.exists(dump):
+            self.logger.debug("using cached dump %s for %s", dump, filename)
+            # mark as recently used for the eviction
+            os.utime(dump, None)
+            return dump
+
+        # dump into a unique file so pairs can be processed concurrently
+        tmpfile = NamedTemporaryFile(prefix="dump-", suffix=".tmp", dir=DUMPCACHE, delete=False)
+        tmpfile.close()
+        if not self.run_abi_dumper(tmpfile.name, base, filename, debuglib):
+            os.unlink(tmpfile.name)
+            return None
+        os.rename(tmpfile.name, dump)
+
+        prune_lru(DUMPCACHE, DUMPCACHE_SIZE, keep=[dump])
+
+        return dump
+
+    def extract(self, project, package, srcinfo, repo, arch, unpackdir=UNPACKDIR):
             # fetch cpio headers
             # check file lists for library packages
             fetchlist, liblist, debuglist = self.compute_fetchlist(project, package, srcinfo, repo, arch)
@@ -702,65 +858,93 @@ class ABIChecker(ReviewBot.ReviewBot):
             downloaded = self.download_files(project, package, repo, arch, fetchlist, mtimes)
 
             # extract binary rpms
-            tmpfile = os.path.join(CACHEDIR, "cpio")
+            dstdir = os.path.join(unpackdir, project, package, repo, arch)
             for fn in fetchlist:
                 self.logger.debug("extract %s"%fn)
-                with open(tmpfile, 'wb') as tmpfd:
-                    if not fn in downloaded:
-                        raise FetchError("%s was not downloaded!"%fn)
-                    self.logger.debug(downloaded[fn])
-                    r = subprocess.call(['rpm2cpio', downloaded[fn]], stdout=tmpfd, close_fds=True)
-                    if r != 0:
-                        raise FetchError("failed to extract %s!"%fn)
-                    tmpfd.close()
-                    os.unlink(downloaded[fn])
-                    cpio = CpioRead(tmpfile)
-                    cpio.read()
-                    for ch in cpio:
-                        fn = ch.filename.decode('utf-8')
-                        if fn.startswith('./'): # rpm payload is relative
-                            fn = fn[1:]
-                        self.logger.debug("cpio fn %s", fn)
-                        if not fn in liblist and not fn in debugfiles:
-                            continue
-                        dst = os.path.join(UNPACKDIR, project, package, repo, arch)
-                        dst += fn
-                        if not os.path.exists(os.path.dirname(dst)):
-                            os.makedirs(os.path.dirname(dst))
-                        self.logger.debug("dst %s", dst)
-                        # the filehandle in the cpio archive is private so
-                        # open it again
-                        with open(tmpfile, 'rb') as cpiofh:
-                            cpiofh.seek(ch.dataoff, os.SEEK_SET)
-                            with open(dst, 'wb') as fh:
-                                while True:
-                                    buf = cpiofh.read(4096)
-                                    if buf is None or buf == b'':
-                                        break
-                                    fh.write(buf)
-            os.unlink(tmpfile)
+                if not fn in downloaded:
+                    raise FetchError("%s was not downloaded!"%fn)
+                self.logger.debug(downloaded[fn])
+                self.extract_payload(downloaded[fn], dstdir, set(liblist.keys()) | set(debugfiles))
 
             return liblist, debuglist
 
+    def extract_payload(self, rpmfn, dstdir, wanted):
+        """ extract the wanted files of an rpm below dstdir
+
+        The payload is decompressed in process and only the wanted members
+        are written, everything else is skipped.
+        """
+        fd = rpm.fd.open(rpmfn)
+        try:
+            h = self.readRpmHeaderFD(fd)
+            if h is None:
+                raise FetchError("failed to read rpm header of %s"%rpmfn)
+            compressor = h['payloadcompressor'] or 'gzip'
+            if isinstance(compressor, bytes):
+                compressor = compressor.decode('utf-8')
+            payload = rpm.fd.open(fd, flags=compressor)
+            archive = rpm.files(h).archive(payload, write=False)
+            for f in archive:
+                fn = f.name
+                if isinstance(fn, bytes):
+                    fn = fn.decode('utf-8')
+                if fn.startswith('./'): # rpm payload is relative
+                    fn = fn[1:]
+                self.logger.debug("payload fn %s", fn)
+                if not fn in wanted or not archive.hascontent():
+                    continue
+                dst = dstdir + fn
+                if not os.path.exists(os.path.dirname(dst)):
+                    os.makedirs(os.path.dirname(dst))
+                self.logger.debug("dst %s", dst)
+                with open(dst, 'wb') as fh:
+                    while True:
+                        buf = archive.read(65536)
+                        if not buf:
+                            break
+                        fh.write(buf)
+        except rpm.error as e:
+            raise FetchError("failed to extract %s: %s"%(rpmfn, e))
+        finally:
+            fd.close()
+
     def download_files(self, project, package, repo, arch, filenames, mtimes):
         downloaded = dict()
         for fn in filenames:
             if not fn in mtimes:
                 raise FetchError("missing mtime information for %s, can't check"% fn)
-            repodir = os.path.join(DOWNLOADS, package, project, repo)
+            repodir = os.path.join(DOWNLOADS, package, project, repo, arch)
             if not os.path.exists(repodir):
                 os.makedirs(repodir)
-            t = os.path.join(repodir, fn)
-            self._get_binary_file(project, repo, arch, package, fn, t, mtimes[fn])
+            # binaries are immutable for a given mtime so the file name is
+            # enough to find a previous download of the same content
+            t = os.path.join(repodir, '%s-%s'%(mtimes[fn], fn))
+            if os.path.exists(t):
+                self.logger.debug("using cached %s", t)
+                os.utime(t, None)
+            else:
+                self._get_binary_file(project, repo, arch, package, fn, t, mtimes[fn])
+                # drop downloads of the same binary superseded by this one
+                superseded = re.compile(r'^\d+-%s$' % re.escape(fn))
+                for old in os.listdir(repodir):
+                    if superseded.match(old) and old != os.path.basename(t):
+                        os.unlink(os.path.join(repodir, old))
             downloaded[fn] = t
+
+        prune_lru(DOWNLOADS, DOWNLOADS_SIZE, keep=downloaded.values())
+
         return downloaded
 
     def _get_binary_file(self, project, repository, arch, package, filename, target, mtime):
         """Get a binary file from OBS."""
-        # Used to cache, but dropped as part of python3 migration.
+        # download to a temporary name so an interrupted download is not
+        # mistaken for a cached one
+        tmpfile = NamedTemporaryFile(prefix="download-", suffix=".tmp", dir=os.path.dirname(target), delete=False)
+        tmpfile.close()
         osc.core.get_binary_file(self.apiurl, project, repository, arch,
                                  filename, package=package,
-                                 target_filename=target)
+                                 target_filename=tmpfile.name)
+        os.rename(tmpfile.name, target)
 
     def readRpmHeaderFD(self, fd):
         h = None
@@ -3,20 +3,34 @@
 from xml.etree import cElementTree as ET
 import sys
 import cmdln
+import json
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 try:
     from urllib.error import HTTPError
+    from urllib.parse import quote_plus, urlparse
 except ImportError:
     # python 2.x
     from urllib2 import HTTPError
+    from urllib import quote_plus
+    from urlparse import urlparse
 import osc.core
 
+from osclib.cache_manager import CacheManager
+from osclib.core import repository_arch_state
+
 import ToolBase
 
 logger = logging.getLogger()
 
 FACTORY = "openSUSE:Factory"
 
+# number of concurrent file list fetches
+FILELIST_WORKERS = 8
+# number of packages to wipe per request
+WIPE_CHUNK = 50
+
 class BiArchTool(ToolBase.ToolBase):
 
     def __init__(self, project):
@@ -27,7 +41,12 @@ class BiArchTool(ToolBase.ToolBase):
         self.packages = []
         self.arch = 'i586'
         self.rdeps = None
+        self._rdeps_state = None
         self.package_metas = dict()
+        self._package_metas_orig = dict()
+        self.srcmd5s = dict()
+        self._filelists = dict()
+        self._filelist_cache = None
         self.whitelist = {
                 'i586': set([
                     'bzr',
@@ -61,6 +80,84 @@ class BiArchTool(ToolBase.ToolBase):
         root = ET.fromstring(self.cached_GET(self.makeurl(['source', self.project, package], query)))
         return [ node.get('name') for node in root.findall('entry') ]
 
+    def _cache_path(self, name):
+        host = urlparse(self.apiurl).hostname
+        return os.path.join(CacheManager.directory('biarchtool', host, self.project), name)
+
+    def _cache_load(self, name):
+        try:
+            with open(self._cache_path(name)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def _cache_save(self, name, data):
+        path = self._cache_path(name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.rename(path + '.tmp', path)
+
+    def _init_sourceinfo(self):
+        # the srcmd5 identifies the (expanded) sources, so file lists can be
+        # cached across runs as long as it does not change
+        url = self.makeurl(['source', self.project], {'view': 'info', 'nofilename': 1})
+        root = ET.fromstring(self.cached_GET(url))
+        self.srcmd5s = dict()
+        for si in root.findall('sourceinfo'):
+            if si.get('srcmd5'):
+                self.srcmd5s[si.get('package')] = si.get('srcmd5')
+
+        self._filelists = dict()
+        if self._filelist_cache is None:
+            self._filelist_cache = self._cache_load('filelists.json') or dict()
+
+    def _save_filelist_cache(self):
+        # only keep entries still referenced by the project
+        current = set(self.srcmd5s.values())
+        self._filelist_cache = { k: v for k, v in self._filelist_cache.items() if k in current }
+        self._cache_save('filelists.json', self._filelist_cache)
+
+    def _fetch_filelists(self, package):
+        files = self.get_filelist(self.project, package)
+        expanded = None
+        if 'baselibs.conf' not in files and '_link' in files:
+            expanded = self.get_filelist(self.project, package, expand = True)
+        return { 'files': files, 'expanded': expanded }
+
+    def _store_filelists(self, package, entry):
+        srcmd5 = self.srcmd5s.get(package)
+        if srcmd5:
+            self._filelist_cache[srcmd5] = entry
+        self._filelists[package] = entry
+
+    def _cached_filelists(self, package):
+        if package in self._filelists:
+            return self._filelists[package]
+        srcmd5 = self.srcmd5s.get(package)
+        if srcmd5 and srcmd5 in self._filelist_cache:
+            self._filelists[package] = self._filelist_cache[srcmd5]
+            return self._filelists[package]
+        return None
+
+    def filelists(self, package):
+        entry = self._cached_filelists(package)
+        if entry is None:
+            entry = self._fetch_filelists(package)
+            self._store_filelists(package, entry)
+        return entry
+
+    def prefetch_filelists(self, packages):
+        todo = sorted(set(p.split(':')[0] for p in packages
+                          if self._cached_filelists(p.split(':')[0]) is None))
+        if not todo:
+            return
+        logger.debug('fetching file lists of %d packages', len(todo))
+        # the persistent GET cache is not safe to share between threads
+        workers = 1 if self.caching else FILELIST_WORKERS
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for package, entry in zip(todo, executor.map(self._fetch_filelists, todo)):
+                self._store_filelists(package, entry)
+
     def has_baselibs(self, package):
         if package in self._has_baselibs:
             return self._has_baselibs[package]
@@ -72,7 +169,8 @@ class BiArchTool(ToolBase.ToolBase):
             srcpkgname = package.split(':')[0]
 
         ret = False
-        files = self.get_filelist(self.project, srcpkgname)
+        filelists = self.filelists(srcpkgname)
+        files = filelists['files']
         if 'baselibs.conf' in files:
             logger.debug('%s has baselibs', package)
             if is_multibuild:
@@ -80,7 +178,7 @@ class BiArchTool(ToolBase.ToolBase):
             else:
                 ret = True
         elif '_link' in files:
-            files = self.get_filelist(self.project, srcpkgname, expand = True)
+            files = filelists['expanded'] or []
             if 'baselibs.conf' in files:
                 logger.warning('%s is linked to a baselibs package', package)
         elif is_multibuild:
@@ -109,6 +207,19 @@ class BiArchTool(ToolBase.ToolBase):
                     break
         return r
 
+    def _biarch_candidates(self, packages):
+        """ packages is_biarch_recursive() may have to look at """
+        seen = set()
+        queue = list(packages)
+        while queue:
+            package = queue.pop()
+            if package in seen or package in self.blacklist[self.arch] \
+                    or package in self.biarch_packages or package in self.whitelist[self.arch]:
+                continue
+            seen.add(package)
+            queue.extend(self.rdeps.get(package, ()))
+        return seen
+
     def _init_biarch_packages(self):
         if self.biarch_packages is None:
             if ':Rings' in self.project:
@@ -118,18 +229,34 @@ class BiArchTool(ToolBase.ToolBase):
                 self.biarch_packages |= set(self.meta_get_packagelist("%s:Rings:1-MinimalX" % self.project))
 
         self._init_rdeps()
+        self._init_sourceinfo()
+        self._has_baselibs = dict()
         self.fill_package_meta()
 
     def fill_package_meta(self):
         url = self.makeurl(['search', 'package'], "match=[@project='%s']" % self.project)
         root = ET.fromstring(self.cached_GET(url))
+        self.package_metas = dict()
+        self._package_metas_orig = dict()
         for p in root.findall('package'):
             name = p.attrib['name']
             self.package_metas[name] = p
+            self._package_metas_orig[name] = ET.tostring(p)
 
     def _init_rdeps(self):
-        if self.rdeps is not None:
+        # the reverse dependencies only change when the repository does
+        state = repository_arch_state(self.apiurl, self.project, 'standard', self.arch)
+        if self.rdeps is not None and state is not None and state == self._rdeps_state:
             return
+
+        cachename = 'rdeps-{}.json'.format(self.arch)
+        cached = self._cache_load(cachename) if state else None
+        if cached and cached.get('state') == state:
+            logger.debug('using cached reverse dependencies for state %s', state)
+            self.rdeps = { name: set(deps) for name, deps in cached['rdeps'].items() }
+            self._rdeps_state = state
+            return
+
         self.rdeps = dict()
         url = self.makeurl(['build', self.project, 'standard', self.arch, '_builddepinfo' ], {'view': 'revpkgnames'})
         x = ET.fromstring(self.cached_GET(url))
@@ -142,6 +269,48 @@ class BiArchTool(ToolBase.ToolBase):
                     continue
                 self.rdeps.setdefault(name, set()).add(depname)
 
+        self._rdeps_state = state
+        if state:
+            self._cache_save(cachename, {
+                'state': state,
+                'rdeps': { name: sorted(deps) for name, deps in self.rdeps.items() },
+            })
+
+    def update_package_metas(self, todo, wipebinaries=False):
+        """ write back changed package metas and wipe newly disabled
+        packages in bulk.
+
+        Metas that serialize to what was fetched are skipped.
+        """
+        wipe = []
+        for pkg in sorted(todo.keys()):
+            pkgmeta = todo[pkg]
+            data = ET.tostring(pkgmeta)
+            if data == self._package_metas_orig.get(pkg):
+                logger.debug('%s meta unchanged', pkg)
+                continue
+            try:
+                pkgmetaurl = self.makeurl(['source', self.project, pkg, '_meta'])
+                self.http_PUT(pkgmetaurl, data=data)
+                if self.caching:
+                    self._invalidate__cached_GET(pkgmetaurl)
+                self._package_metas_orig[pkg] = data
+            except HTTPError as e:
+                logger.error('failed to update %s: %s', pkg, e)
+                continue
+
+            if wipebinaries and pkgmeta.find("./build/disable[@arch='{}']".format(self.arch)) is not None:
+                wipe.append(pkg)
+
+        for packages in ToolBase.chunks(wipe, WIPE_CHUNK):
+            logger.debug("wiping %s", ', '.join(packages))
+            query = ['cmd=wipe', 'arch={}'.format(quote_plus(self.arch))]
+            query += ['package={}'.format(quote_plus(pkg)) for pkg in packages]
+            try:
+                self.http_POST(self.makeurl(['build', self.project], query))
+            except HTTPError as e:
+                logger.error('failed to wipe %s: %s', ', '.join(packages), e)
+
     def select_packages(self, packages):
         if packages == '__all__':
             self.packages = self.meta_get_packagelist(self.project)
@@ -185,6 +354,7 @@ class BiArchTool(ToolBase.ToolBase):
             if n.get('code') not in ('disabled', 'excluded'):
                 packages.add(n.get('package'))
 
+        todo = dict()
         for pkg in sorted(packages):
             changed = False
 
@@ -201,13 +371,9 @@ class BiArchTool(ToolBase.ToolBase):
                     changed = True
 
             if changed:
-                try:
-                    pkgmetaurl = self.makeurl(['source', self.project, pkg, '_meta'])
-                    self.http_PUT(pkgmetaurl, data=ET.tostring(pkgmeta))
-                    if self.caching:
-                        self._invalidate__cached_GET(pkgmetaurl)
-                except HTTPError as e:
-                    logger.error('failed to update %s: %s', pkg, e)
+                todo[pkg] = pkgmeta
+
+        self.update_package_metas(todo)
 
     def add_explicit_disable(self, wipebinaries=False):
 
@@ -216,6 +382,7 @@ class BiArchTool(ToolBase.ToolBase):
         resulturl = self.makeurl(['source', self.project])
         result = ET.fromstring(self.cached_GET(resulturl))
 
+        todo = dict()
         for pkg in self.packages:
 
             changed = False
@@ -236,21 +403,16 @@ class BiArchTool(ToolBase.ToolBase):
                 changed = True
 
             if changed:
-                try:
-                    pkgmetaurl = self.makeurl(['source', self.project, pkg, '_meta'])
-                    self.http_PUT(pkgmetaurl, data=ET.tostring(pkgmeta))
-                    if self.caching:
-                        self._invalidate__cached_GET(pkgmetaurl)
-                    if wipebinaries:
-                        self.http_POST(self.makeurl(['build', self.project], {
-                            'cmd': 'wipe',
-                            'arch': self.arch,
-                            'package': pkg }))
-                except HTTPError as e:
-                    logger.error('failed to update %s: %s', pkg, e)
+                todo[pkg] = pkgmeta
+
+        self.update_package_metas(todo, wipebinaries)
 
     def enable_baselibs_packages(self, force=False, wipebinaries=False):
         self._init_biarch_packages()
+        if not force:
+            self.prefetch_filelists(self._biarch_candidates(
+                [pkg for pkg in self.packages if pkg in self.package_metas]))
+            self._save_filelist_cache()
         todo = dict()
         for pkg in self.packages:
             logger.debug("processing %s", pkg)
@@ -315,22 +477,7 @@ class BiArchTool(ToolBase.ToolBase):
 
         if todo:
             logger.info("applying changes")
-        for pkg in sorted(todo.keys()):
-            pkgmeta = todo[pkg]
-            try:
-                pkgmetaurl = self.makeurl(['source', self.project, pkg, '_meta'])
-                self.http_PUT(pkgmetaurl, data=ET.tostring(pkgmeta))
-                if self.caching:
-                    self._invalidate__cached_GET(pkgmetaurl)
-
-                if wipebinaries and pkgmeta.find("./build/disable[@arch='{}']".format(self.arch)) is not None:
-                    logger.debug("wiping %s", pkg)
-                    self.http_POST(self.makeurl(['build', self.project], {
-                        'cmd': 'wipe',
-                        'arch': self.arch,
-                        'package': pkg }))
-            except HTTPError as e:
-                logger.error('failed to update %s: %s', pkg, e)
+        self.update_package_metas(todo, wipebinaries)
 
 class CommandLineInterface(ToolBase.CommandLineInterface):
 
@@ -1,5 +1,6 @@
 #!/usr/bin/python3
 
+from concurrent.futures import ProcessPoolExecutor
 from pprint import pprint
 import io
 import os
@@ -14,13 +15,68 @@ import re
 SRPM_RE = re.compile(
     r'(?P<name>.+)-(?P<version>[^-]+)-(?P<release>[^-]+)\.(?P<suffix>(?:no)?src\.rpm)$')
 
-data_version = 3
+data_version = 4
+
+# subdirectory of the data directory holding the changelogs of all snapshots
+CHANGELOG_STORE = '.changelogs'
+
+# headers read per task by each worker process
+HEADER_CHUNK = 64
+
+# source packages of the kernel flavors which are reported as kernel-source
+KERNEL_FLAVORS = (
+    'kernel-debug',
+    'kernel-default',
+    'kernel-desktop',
+    'kernel-docs',
+    'kernel-ec2',
+    'kernel-lpae',
+    'kernel-obs-build',
+    'kernel-obs-qa-xen',
+    'kernel-obs-qa',
+    'kernel-pae',
+    'kernel-pv',
+    'kernel-syms',
+    'kernel-vanilla',
+    'kernel-xen',
+)
 
 try:
     from xml.etree import cElementTree as ET
 except ImportError:
     import cElementTree as ET
 
+_worker_ts = None
+
+def _worker_init():
+    global _worker_ts
+    _worker_ts = rpm.TransactionSet()
+    _worker_ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES)
+
+def _read_header(item):
+    """
+    Read the header of the rpm at offset of path in a worker process and
+    return the relevant tags, header objects can not be passed back.
+    """
+    path, offset = item
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if offset:
+            os.lseek(fd, offset, io.SEEK_SET)
+        h = _worker_ts.hdrFromFdno(fd)
+    except rpm.error as e:
+        print('%s: %s' % (path, e), file=sys.stderr)
+        return None
+    finally:
+        os.close(fd)
+
+    data = dict()
+    for tag in ['name', 'version', 'release', 'sourcerpm']:
+        data[tag] = str(h[tag], 'utf-8')
+    data['changelogtime'] = list(h['changelogtime'])
+    data['changelogtext'] = [str(txt, 'utf-8') for txt in h['changelogtext']]
+    return data
+
 class ChangeLogger(cmdln.Cmdln):
     def __init__(self, *args, **kwargs):
         cmdln.Cmdln.__init__(self, args, kwargs)
@@ -48,60 +104,16 @@ class ChangeLogger(cmdln.Cmdln):
             h = None
         return h
 
-    def readChangeLogs(self, args):
-
-        pkgdata = dict()
-        changelogs = dict()
-
-        def _getdata(h):
-            srpm = str(h['sourcerpm'], 'utf-8')
-            binrpm = str(h['name'], 'utf-8')
-
-            evr = dict()
-            for tag in ['name', 'version', 'release', 'sourcerpm']:
-                evr[tag] = str(h[tag], 'utf-8')
-            pkgdata[binrpm] = evr
-
-            # dirty hack to reduce kernel spam
-            m = SRPM_RE.match(srpm)
-            if m and m.group('name') in (
-                'kernel-debug',
-                'kernel-default',
-                'kernel-desktop',
-                'kernel-docs',
-                'kernel-ec2',
-                'kernel-lpae',
-                'kernel-obs-build',
-                'kernel-obs-qa-xen',
-                'kernel-obs-qa',
-                'kernel-pae',
-                'kernel-pv',
-                'kernel-syms',
-                'kernel-vanilla',
-                'kernel-xen',
-                ):
-                srpm = '%s-%s-%s.src.rpm' % ('kernel-source', m.group('version'), m.group('release'))
-                pkgdata[binrpm]['sourcerpm'] = srpm
-                print("%s -> %s" % (str(h['sourcerpm'], 'utf-8'), srpm))
-
-            if srpm in changelogs:
-                changelogs[srpm]['packages'].append(binrpm)
-            else:
-                data = { 'packages': [ binrpm ] }
-                data['changelogtime'] = h['changelogtime']
-                data['changelogtext'] = h['changelogtext']
-                for (t, txt) in enumerate(data['changelogtext']):
-                    data['changelogtext'][t] = str(txt, 'utf-8')
-                changelogs[srpm] = data
-
+    def rpmLocations(self, args):
+        """ List (path, offset) of all rpms in the given ISOs and directories. """
+        items = []
         for arg in args:
             if arg.endswith('.iso'):
                 import pycdio
                 import iso9660
                 iso = iso9660.ISO9660.IFS(source=arg)
-                fd = os.open(arg, os.O_RDONLY)
 
-                if not iso.is_open() or fd is None:
+                if not iso.is_open():
                     raise Exception("Could not open %s as an ISO-9660 image." % arg)
 
                 # On Tumbleweed, there is no '/suse' prefix
@@ -114,31 +126,92 @@ class ChangeLogger(cmdln.Cmdln):
                     for stat in file_stats:
                         filename = stat[0]
                         LSN = stat[1]
-                        size = stat[2]
-                        sec_size = stat[3]
-                        is_dir = stat[4] == 2
-#                       print("%s [LSN %6d] %8d %s%s" % (dir_tr[is_dir], LSN, size, path,
-#                           iso9660.name_translate(filename)))
-
                         if (filename.endswith('.rpm')):
-                            os.lseek(fd, LSN * pycdio.ISO_BLOCKSIZE, io.SEEK_SET)
-                            h = self.ts.hdrFromFdno(fd)
-                            _getdata(h)
-
-                os.close(fd)
+                            items.append((arg, LSN * pycdio.ISO_BLOCKSIZE))
 
             elif os.path.isdir(arg):
                 for root, dirs, files in os.walk(arg):
                     for pkg in [ os.path.join(root, file) for file in files]:
                         if not pkg.endswith('.rpm'):
                             continue
-                        h = self.readRpmHeader( pkg )
-                        _getdata(h)
+                        items.append((pkg, None))
             else:
                 raise Exception("don't know what to do with %s" % arg)
 
+        return items
+
+    def readChangeLogs(self, args):
+
+        pkgdata = dict()
+        changelogs = dict()
+
+        def _getdata(h):
+            srpm = h['sourcerpm']
+            binrpm = h['name']
+
+            evr = dict()
+            for tag in ['name', 'version', 'release', 'sourcerpm']:
+                evr[tag] = h[tag]
+            pkgdata[binrpm] = evr
+
+            # dirty hack to reduce kernel spam
+            m = SRPM_RE.match(srpm)
+            if m and m.group('name') in KERNEL_FLAVORS:
+                srpm = '%s-%s-%s.src.rpm' % ('kernel-source', m.group('version'), m.group('release'))
+                pkgdata[binrpm]['sourcerpm'] = srpm
+                print("%s -> %s" % (h['sourcerpm'], srpm))
+
+            if srpm in changelogs:
+                changelogs[srpm]['packages'].append(binrpm)
+            else:
+                data = { 'packages': [ binrpm ] }
+                data['changelogtime'] = h['changelogtime']
+                data['changelogtext'] = h['changelogtext']
+                changelogs[srpm] = data
+
+        items = self.rpmLocations(args)
+        self.logger.info('reading %d rpm headers', len(items))
+        with ProcessPoolExecutor(self.options.jobs, initializer=_worker_init) as executor:
+            # map() keeps the order so the result does not depend on timing.
+            for h in executor.map(_read_header, items, chunksize=HEADER_CHUNK):
+                if h is not None:
+                    _getdata(h)
+
         return pkgdata, changelogs
 
+    def _changelog_path(self, directory, srpm, changelogtime):
+        head = changelogtime[0] if len(changelogtime) else 'none'
+        return os.path.join(directory, CHANGELOG_STORE, '%s-%s' % (srpm, head))
+
+    def _changelog_save(self, directory, srpm, data):
+        """ Store the changelog of srpm unless a snapshot already did. """
+        path = self._changelog_path(directory, srpm, data['changelogtime'])
+        if os.path.exists(path):
+            return
+        with open(path + '.new', 'wb') as f:
+            pickle.dump((data['changelogtime'], data['changelogtext']), f)
+        os.rename(path + '.new', path)
+
+    def _changelog_load(self, directory, srpm, data):
+        """ Return the changelog entries (times, texts) of srpm. """
+        if 'changelogtext' in data:
+            # version 3 snapshots include the changelogs
+            return data['changelogtime'], data['changelogtext']
+        with open(self._changelog_path(directory, srpm, data['changelogtime']), 'rb') as f:
+            return pickle.load(f, encoding='utf-8', errors='backslashreplace')
+
+    def _snapshot_load(self, directory, version):
+        """
+        Return the packages and source packages of a snapshot. Only the head
+        of each changelog is included, see _changelog_load() for the rest.
+        """
+        with open(os.path.join(directory, version), 'rb') as f:
+            (v, (pkgs, changelogs)) = pickle.load(f,
+                encoding='utf-8', errors='backslashreplace')
+        if v not in (3, data_version):
+            raise Exception("not matching version %s in %s" % (v, version))
+        return pkgs, changelogs
+
     @cmdln.option("--snapshot", action="store", type='string', help="snapshot number")
     @cmdln.option("--dir", action="store", type='string', dest='dir', help="data directory")
     def do_save(self, subcmd, opts, *dirs):
@@ -155,8 +228,23 @@ class ChangeLogger(cmdln.Cmdln):
         if not opts.snapshot:
             raise Exception("missing snapshot option")
 
+        pkgdata, changelogs = self.readChangeLogs(dirs)
+
+        # The changelogs are stored once per source package and head entry,
+        # the snapshot only refers to them.
+        store = os.path.join(opts.dir, CHANGELOG_STORE)
+        if not os.path.isdir(store):
+            os.mkdir(store)
+        srpms = dict()
+        for srpm, data in changelogs.items():
+            self._changelog_save(opts.dir, srpm, data)
+            srpms[srpm] = {
+                'packages': data['packages'],
+                'changelogtime': data['changelogtime'][:1],
+            }
+
         f = open(os.path.join(opts.dir, opts.snapshot), 'wb')
-        pickle.dump([data_version, self.readChangeLogs(dirs)], f)
+        pickle.dump([data_version, (pkgdata, srpms)], f)
 
     def do_dump(self, subcmd, opts, *dirs):
         """${cmd_name}: pprint the package changelog information
@@ -172,11 +260,13 @@ class ChangeLogger(cmdln.Cmdln):
         ${cmd_usage}
         ${cmd_option_list}
         """
-        f = open(filename, 'rb')
-        (v, (pkgs, changelogs)) = pickle.load(
-            f, encoding='utf-8', errors='backslashreplace')
+        (pkgs, changelogs) = self._snapshot_load(*os.path.split(filename))
         pprint(pkgs[package])
-        pprint(changelogs[pkgs[package]['sourcerpm']])
+        srpm = pkgs[package]['sourcerpm']
+        data = dict(changelogs[srpm])
+        data['changelogtime'], data['changelogtext'] = self._changelog_load(
+            os.path.dirname(filename), srpm, changelogs[srpm])
+        pprint(data)
 
     def _get_packages_grouped(self, pkgs, names):
         group = dict()
@@ -199,16 +289,8 @@ class ChangeLogger(cmdln.Cmdln):
         if not os.path.isdir(opts.dir):
             raise Exception("%s must be a directory" % opts.dir)
 
-        f = open(os.path.join(opts.dir, version1), 'rb')
-        (v, (v1pkgs, v1changelogs)) = pickle.load(f,
-            encoding='utf-8', errors='backslashreplace')
-        if v != data_version:
-            raise Exception("not matching version %s in %s" % (v, version1))
-        f = open(os.path.join(opts.dir, version2), 'rb')
-        (v, (v2pkgs, v2changelogs)) = pickle.load(f,
-            encoding='utf-8', errors='backslashreplace')
-        if v != data_version:
-            raise Exception("not matching version %s in %s" % (v, version2))
+        (v1pkgs, v1changelogs) = self._snapshot_load(opts.dir, version1)
+        (v2pkgs, v2changelogs) = self._snapshot_load(opts.dir, version2)
 
         p1 = set(v1pkgs.keys())
         p2 = set(v2pkgs.keys())
@@ -250,10 +332,11 @@ class ChangeLogger(cmdln.Cmdln):
                 print("  %s" % name)
             if len(pkgs) > 1:
                 details += "Subpackages: %s\n" % " ".join([p for p in pkgs if p != name])
-            for (i2, t2) in enumerate(v2changelogs[srpm]['changelogtime']):
+            (times, texts) = self._changelog_load(opts.dir, srpm, v2changelogs[srpm])
+            for (i2, t2) in enumerate(times):
                 if t2 == t1:
                     break
-                details += "\n" + v2changelogs[srpm]['changelogtext'][i2]
+                details += "\n" + texts[i2]
             details += '\n'
 
         print("\n=== Details ===")
@@ -264,6 +347,7 @@ class ChangeLogger(cmdln.Cmdln):
         parser.add_option("--dry", action="store_true", help="dry run")
         parser.add_option("--debug", action="store_true", help="debug output")
         parser.add_option("--verbose", action="store_true", help="verbose")
+        parser.add_option("-j", "--jobs", type="int", help="number of processes reading rpm headers")
         return parser
 
     def postoptparse(self):
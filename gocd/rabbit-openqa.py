@@ -11,6 +11,7 @@ from time import sleep
 from osc.core import http_GET, http_POST, makeurl
 from M2Crypto.SSL import SSLError as SSLError
 from osclib.conf import Config
+from osclib.openqa_jobs import OpenQAJobs
 from osclib.stagingapi import StagingAPI
 from lxml import etree as ET
 from openqa_client.client import OpenQA_Client
@@ -21,6 +22,10 @@ from urllib.parse import quote_plus
 import requests
 from osclib.PubSubConsumer import PubSubConsumer
 
+# seconds a jobs query is cached and number of queries kept by the listener
+JOBS_TTL = 600
+JOBS_MAX_ENTRIES = 500
+
 class Project(object):
     def __init__(self, name):
         self.name = name
@@ -165,6 +170,8 @@ class Listener(PubSubConsumer):
         self.amqp_prefix = amqp_prefix
         self.openqa_url = openqa_url
         self.openqa = OpenQA_Client(server=openqa_url)
+        # events keep it current, the ttl covers missed ones
+        self.openqa_jobs = OpenQAJobs(self.openqa, ttl=JOBS_TTL, max_entries=JOBS_MAX_ENTRIES)
         self.projects_to_check = set()
 
     def routing_keys(self):
@@ -182,6 +189,8 @@ class Listener(PubSubConsumer):
         # now we are (re-)connected to the bus and need to fetch the
         # initial state
         self.projects_to_check = set()
+        # job events may have been missed while disconnected
+        self.openqa_jobs.invalidate()
         for project in self.projects:
             self.logger.info('Fetching ISOs of %s', project.name)
             for sproj in project.init():
@@ -208,13 +217,16 @@ class Listener(PubSubConsumer):
         self.check_some_projects()
         super(Listener, self).still_alive()
 
-    def jobs_for_iso(self, iso):
-        values = {
-            'iso': iso,
+    def iso_query(self):
+        return {
             'scope': 'current',
             'latest': '1',
         }
-        return self.openqa.openqa_request('GET', 'jobs', values)['jobs']
+
+    def jobs_for_iso(self, iso):
+        values = self.iso_query()
+        values['iso'] = iso
+        return self.openqa_jobs.jobs(values)
 
     def get_step_url(self, testurl, modulename):
         failurl = testurl + '/modules/{!s}/fails'.format(quote_plus(modulename))
@@ -234,8 +246,10 @@ class Listener(PubSubConsumer):
         for p in self.projects:
             p.check_published_repo(str(payload['project']), str(payload['repo']), str(payload['buildid']))
 
-    def on_openqa_job(self, iso):
+    def on_openqa_job(self, payload):
+        iso = payload.get('ISO')
         self.logger.debug('openqa_job_change %s', iso)
+        self.openqa_jobs.invalidate(payload)
         for p in self.projects:
             p.openqa_job_change(iso)
 
@@ -244,7 +258,7 @@ class Listener(PubSubConsumer):
         if method.routing_key == '{}.obs.repo.published'.format(amqp_prefix):
             self.on_published_repo(json.loads(body))
         elif re.search(r'.openqa.', method.routing_key):
-            self.on_openqa_job(json.loads(body).get('ISO'))
+            self.on_openqa_job(json.loads(body))
         else:
             self.logger.warning("unknown rabbitmq message {}".format(method.routing_key))
 
@@ -1,11 +1,14 @@
 #!/usr/bin/python3
 
 from pprint import pprint
+import copy
 import os
 import sys
 import re
 import logging
 from optparse import OptionParser
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
 import cmdln
 
 try:
@@ -17,14 +20,122 @@ import osc.core
 from osclib.conf import Config
 from osclib.core import devel_project_get
 
-from urllib.error import HTTPError
+from urllib.error import HTTPError, URLError
 
 import yaml
 import ReviewBot
 from check_source_in_factory import FactorySourceChecker
 
+class SourceIndex(object):
+    """ per run index of the sources of packages in candidate projects
+
+    Leaper compares the submitted sources against a long list of projects.
+    Instead of asking the server once per project and question the
+    sourceinfo and history of all candidates are fetched concurrently and
+    all srcmd5 questions are answered from memory.
+    """
+
+    def __init__(self, apiurl, logger, workers=8):
+        self.apiurl = apiurl
+        self.logger = logger
+        self.workers = workers
+        self.reset()
+
+    def reset(self):
+        # (project, package) => verifymd5 ('' if unknown) or None if the
+        # package is missing
+        self.verifymd5 = {}
+        # (project, package, limit) => list of srcmd5, latest first
+        self.history = {}
+
+    def prefetch(self, projects, package, history_limit=5):
+        todo = []
+        for project in projects:
+            if project in todo:
+                continue
+            if (project, package) not in self.verifymd5:
+                todo.append(project)
+            elif self.verifymd5[(project, package)] is not None and history_limit and \
+                (project, package, history_limit) not in self.history:
+                todo.append(project)
+        if not todo:
+            return
+
+        self.logger.debug("prefetching %s in %s", package, ', '.join(todo))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # consume the results so errors of the workers are raised here
+            list(executor.map(lambda project: self._fetch(project, package, history_limit), todo))
+
+    def _fetch(self, project, package, history_limit):
+        key = (project, package)
+        if key not in self.verifymd5:
+            root = ReviewBot.ReviewBot._get_sourceinfo(self.apiurl, project, package)
+            if root is not None and root.get('verifymd5'):
+                self.verifymd5[key] = root.get('verifymd5')
+            else:
+                # no sources (eg. broken link) does not mean the package is
+                # missing, only a missing meta does
+                try:
+                    osc.core.show_package_meta(self.apiurl, project, package)
+                    self.verifymd5[key] = ''
+                except (HTTPError, URLError):
+                    self.verifymd5[key] = None
+
+        if self.verifymd5[key] is None or not history_limit:
+            return
+
+        key = (project, package, history_limit)
+        if key not in self.history:
+            u = osc.core.makeurl(self.apiurl, ['source', project, package, '_history'], {'limit': history_limit})
+            try:
+                root = ET.parse(osc.core.http_GET(u)).getroot()
+            except (HTTPError, URLError):
+                self.history[key] = None
+                return
+
+            # we need this complicated construct as obs doesn't honor
+            # the 'limit' parameter use above for obs interconnect:
+            # https://github.com/openSUSE/open-build-service/issues/2545
+            srcmd5s = []
+            for revision, i in zip(reversed(root.findall('revision')), count()):
+                node = revision.find('srcmd5')
+                if node is not None:
+                    srcmd5s.append(node.text)
+                if i == history_limit:
+                    break
+            self.history[key] = srcmd5s
+
+    def matching_srcmd5(self, project, package, rev, history_limit=5):
+        """ same semantics as ReviewBot._check_matching_srcmd5 """
+        self.prefetch([project], package, history_limit)
+
+        verifymd5 = self.verifymd5[(project, package)]
+        if verifymd5 is None:
+            self.logger.debug("new package")
+            return None
+
+        if rev == verifymd5:
+            self.logger.debug("srcmd5 matches")
+            return True
+
+        if history_limit:
+            srcmd5s = self.history[(project, package, history_limit)]
+            if srcmd5s is None:
+                self.logger.debug("package has no history!?")
+                return None
+            if rev in srcmd5s:
+                self.logger.debug("got it in history")
+                return True
+
+            self.logger.debug("srcmd5 not found in history either")
+
+        return False
+
 class Leaper(ReviewBot.ReviewBot):
 
+    # all per request state is reset in check_one_request
+    thread_safe = True
+
     def __init__(self, *args, **kwargs):
         ReviewBot.ReviewBot.__init__(self, *args, **kwargs)
 
@@ -54,10 +165,20 @@ class Leaper(ReviewBot.ReviewBot):
         # project => package list
         self.packages = {}
 
+        self.source_index = SourceIndex(self.apiurl, self.logger)
+
+    def thread_copy(self, logger):
+        bot = super(Leaper, self).thread_copy(logger)
+        # the factory checker logs into the comment as well
+        bot.factory = copy.copy(self.factory)
+        bot.factory.logger = logger
+        return bot
+
     def prepare_review(self):
         # update lookup information on every run
 
         self.lookup.reset()
+        self.source_index.reset()
 
     def get_source_packages(self, project, expand=False):
         """Return the list of packages in a project."""
@@ -122,6 +243,13 @@ class Leaper(ReviewBot.ReviewBot):
                 'target_package': target_package,
                 }
 
+    def _check_matching_srcmd5(self, project, package, rev, history_limit = 5):
+        self.logger.debug("checking %s in %s" % (package, project))
+        return self.source_index.matching_srcmd5(project, package, rev, history_limit)
+
+    def _factory_projects(self, target_project):
+        return [''.join((target_project, subprj)) for subprj in ('', ':NonFree', ':Live')]
+
     def _check_same_origin(self, origin, project):
 
         if origin == 'FORK':
@@ -214,6 +342,8 @@ class Leaper(ReviewBot.ReviewBot):
                         leap = 'openSUSE.org:openSUSE:Leap:%s' % (version)
                         other_projects_to_check += [ leap, leap + ':Update', leap + ':NonFree', leap + ':NonFree:Update' ]
 
+                self.source_index.prefetch([prj for prj in other_projects_to_check
+                                            if self.is_package_in_project(prj, package)], package)
                 for prj in other_projects_to_check:
                     if self.is_package_in_project(prj, package):
                         self.logger.debug('checking {}'.format(prj))
@@ -498,8 +628,8 @@ class Leaper(ReviewBot.ReviewBot):
         return False
 
     def _check_factory(self, target_package, src_srcinfo, target_project='openSUSE:Factory'):
-        for subprj in ('', ':NonFree', ':Live'):
-            prj = ''.join((target_project, subprj))
+        self.source_index.prefetch(self._factory_projects(target_project), target_package)
+        for prj in self._factory_projects(target_project):
             good = self._check_matching_srcmd5(prj, target_package, src_srcinfo.verifymd5)
             if good:
                 return good
@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from dateutil.parser import parse as date_parse
 from datetime import datetime
 import itertools
@@ -24,6 +25,11 @@ from osclib.memoize import memoize
 
 logger = logging.getLogger()
 
+# number of projects whose sourceinfo is loaded concurrently
+SOURCEINFO_WORKERS = 4
+# crawls of at least this many packages load the sourceinfo of all projects
+PREFETCH_MIN_PACKAGES = 20
+
 makeurl = osc.core.makeurl
 http_GET = osc.core.http_GET
 http_DELETE = osc.core.http_DELETE
@@ -55,6 +61,8 @@ class Manager42(object):
         self.parse_lookup(self.config.from_prj)
         self.fill_package_meta()
         self.packages = dict()
+        self.sourceinfo = dict()
+        self.verifymd5_index = dict()
         self.sle_workarounds = None
         for project in [self.config.from_prj] + self.config.project_preference_order:
             self._fill_package_list(project)
@@ -153,9 +161,44 @@ class Manager42(object):
         return self.cached_GET(makeurl(self.apiurl,
                                 ['source', project, package], opts))
 
+    def get_project_sourceinfo(self, project):
+        """Return the sourceinfo of all packages in a project by package."""
+        try:
+            root = ET.fromstring(self.cached_GET(makeurl(self.apiurl,
+                                 ['source', project], {'view': 'info', 'nofilename': 1})))
+        except HTTPError as e:
+            if e.code == 404:
+                logger.error("{}: {}".format(project, e))
+                return dict()
+            raise
+        return dict((si.get('package'), si) for si in root.findall('sourceinfo'))
+
+    def prefetch_sourceinfo(self):
+        """Load the sourceinfo of from_prj and all preferred projects and
+        index the current sources by verifymd5 so packages matching the head
+        of a project are resolved without looking at their history."""
+        projects = []
+        for project in [self.config.from_prj] + self.config.project_preference_order:
+            if project not in projects and project not in self.sourceinfo:
+                projects.append(project)
+
+        # the persistent GET cache is not safe to share between threads
+        workers = 1 if self.caching else SOURCEINFO_WORKERS
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for project, sourceinfo in zip(projects, executor.map(self.get_project_sourceinfo, projects)):
+                logger.debug('loaded sourceinfo of {} packages in {}'.format(len(sourceinfo), project))
+                self.sourceinfo[project] = sourceinfo
+                for package, si in sourceinfo.items():
+                    if si.get('verifymd5'):
+                        self.verifymd5_index.setdefault(si.get('verifymd5'), []).append(
+                            (project, package, si.get('srcmd5'), si.get('rev')))
+
     def crawl(self, packages):
         """Main method of the class that runs the crawler."""
 
+        if len(packages) >= PREFETCH_MIN_PACKAGES:
+            self.prefetch_sourceinfo()
+
         for package in sorted(packages):
             try:
                 self.check_one_package(package)
@@ -248,6 +291,11 @@ class Manager42(object):
         if not deleted and not package in self.packages[project]:
             return None, None
 
+        if not deleted:
+            for (prj, pkg, srcmd5, rev) in self.verifymd5_index.get(verifymd5, []):
+                if prj == project and pkg == package:
+                    return srcmd5, rev
+
         his = self.get_package_history(project, package, deleted)
         if his is None:
             return None, None
@@ -281,7 +329,9 @@ class Manager42(object):
                 self.lookup_changes += 1
             return
 
-        root = ET.fromstring(self._get_source_package(self.config.from_prj, package, None))
+        root = self.sourceinfo.get(self.config.from_prj, {}).get(package)
+        if root is None:
+            root = ET.fromstring(self._get_source_package(self.config.from_prj, package, None))
         linked = root.find('linked')
         if not linked is None and linked.get('package') != package:
             lstring = 'subpackage of {}'.format(linked.get('package'))
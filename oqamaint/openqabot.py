@@ -6,12 +6,14 @@ from pprint import pformat
 from urllib.error import HTTPError
 from urllib.parse import quote_plus
 from osclib.comments import CommentAPI
+from osclib.openqa_jobs import OpenQAJobs
 
 import requests
 import osc.core
 
 import ReviewBot
 
+from oqamaint import repomd
 from oqamaint.suse import SUSEUpdate
 
 from xml.etree import cElementTree as ET
@@ -36,6 +38,7 @@ class OpenQABot(ReviewBot.ReviewBot):
         self.bot_name = 'openqa'
         self.force = False
         self.openqa = None
+        self.openqa_job_view = None
         self.commentapi = CommentAPI(self.apiurl)
 
     def gather_test_builds(self):
@@ -62,6 +65,8 @@ class OpenQABot(ReviewBot.ReviewBot):
         self.update_test_builds = {}
         self.pending_target_repos = set()
         self.openqa_jobs = {}
+        # one consistent view of openQA per run
+        self.openqa_job_view = OpenQAJobs(self.openqa)
 
         if self.ibs:
             self.check_suse_incidents()
@@ -87,14 +92,7 @@ class OpenQABot(ReviewBot.ReviewBot):
         # if you want to force it, increase this number
         m.update(b'b')
         for url in repos:
-            url += '/repodata/repomd.xml'
-            try:
-                root = ET.parse(osc.core.http_GET(url)).getroot()
-            except HTTPError:
-                raise
-            cs = root.find(
-                './/{http://linux.duke.edu/metadata/repo}data[@type="primary"]/{http://linux.duke.edu/metadata/repo}checksum')
-            m.update(cs.text.encode('utf-8'))
+            m.update(repomd.cache.get(url).checksums['primary'].encode('utf-8'))
         # now add the open incidents
         m.update(json.dumps(incidents, sort_keys=True).encode('utf-8'))
         digest = m.hexdigest()
@@ -161,7 +159,7 @@ class OpenQABot(ReviewBot.ReviewBot):
         else:
             values['test'] = data['test']
         self.logger.debug("Get jobs: {}".format(pformat(values)))
-        return self.openqa.openqa_request('GET', 'jobs', values)['jobs']
+        return self.openqa_job_view.jobs(values)
 
     # we don't know the current BUILD and querying all jobs is too expensive
     # so we need to check for one known TEST first
@@ -217,6 +215,7 @@ class OpenQABot(ReviewBot.ReviewBot):
             try:
                 self.logger.info("Openqa isos POST {}".format(pformat(s)))
                 self.openqa.openqa_request('POST', 'isos', data=s, retries=1)
+                self.openqa_job_view.invalidate(s)
             except Exception as e:
                 self.logger.error(e)
         self.update_test_builds[prj] = buildnr
@@ -480,18 +479,21 @@ class OpenQABot(ReviewBot.ReviewBot):
         self.logger.debug("Pmap: {} Posts: {}".format(pmap, posts))
         return posts
 
+    @staticmethod
+    def incident_query(s):
+        return {
+            'distri': s['DISTRI'],
+            'version': s['VERSION'],
+            'arch': s['ARCH'],
+            'flavor': s['FLAVOR'],
+            'scope': 'relevant',
+            'latest': '1'
+        }
+
     def incident_openqa_jobs(self, s):
-        return self.openqa.openqa_request(
-            'GET', 'jobs',
-            {
-                'distri': s['DISTRI'],
-                'version': s['VERSION'],
-                'arch': s['ARCH'],
-                'flavor': s['FLAVOR'],
-                'build': s['BUILD'],
-                'scope': 'relevant',
-                'latest': '1'
-            })['jobs']
+        values = self.incident_query(s)
+        values['build'] = s['BUILD']
+        return self.openqa_job_view.jobs(values)
 
     # for SUSE we use mesh, for openSUSE we limit the jobs to open release requests
     def check_opensuse_incidents(self):
@@ -569,6 +571,7 @@ class OpenQABot(ReviewBot.ReviewBot):
                 else:
                     self.logger.info("Posted: {}".format(pformat(json.dumps(s, sort_keys=True))))
                     self.openqa.openqa_request('POST', 'isos', data=s, retries=1)
+                    self.openqa_job_view.invalidate(s)
                     openqa_jobs += self.incident_openqa_jobs(s)
             else:
                 self.logger.info("{} got {}".format(pformat(s), len(jobs)))
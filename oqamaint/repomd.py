@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+from urllib.error import HTTPError
+from xml.etree import cElementTree as ET
+
+import osc.core
+
+REPO_NS = '{http://linux.duke.edu/metadata/repo}'
+
+CacheEntry = namedtuple('CacheEntry', ('etag', 'last_modified', 'repomd'))
+
+
+class Repomd(object):
+
+    """ the parts of a repomd.xml the maintenance bots look at
+    """
+
+    def __init__(self, xml):
+        root = ET.fromstring(xml)
+        revision = root.find('.//' + REPO_NS + 'revision')
+        self.revision = revision.text if revision is not None else None
+        self.checksums = {}
+        self.locations = {}
+        for data in root.findall(REPO_NS + 'data'):
+            kind = data.get('type')
+            checksum = data.find(REPO_NS + 'checksum')
+            if checksum is not None:
+                self.checksums[kind] = checksum.text
+            location = data.find(REPO_NS + 'location')
+            if location is not None:
+                self.locations[kind] = location.get('href')
+
+
+class RepomdCache(object):
+
+    """ conditional GET cache for repomd.xml documents
+
+    Every poll sends the ETag and Last-Modified of the previous answer, so
+    repositories that did not change are served from memory without
+    downloading and parsing their metadata again.
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    @staticmethod
+    def url(repo):
+        return repo.rstrip('/') + '/repodata/repomd.xml'
+
+    def get(self, repo):
+        """ return the Repomd of repo, raises HTTPError if not available
+        """
+        url = self.url(repo)
+        entry = self.entries.get(url)
+        headers = {}
+        if entry:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        try:
+            f = osc.core.http_GET(url, headers=headers)
+        except HTTPError as e:
+            if e.code == 304 and entry:
+                return entry.repomd
+            self.entries.pop(url, None)
+            raise e
+
+        repomd = Repomd(f.read())
+        etag = f.headers.get('ETag')
+        last_modified = f.headers.get('Last-Modified')
+        if etag or last_modified:
+            self.entries[url] = CacheEntry(etag, last_modified, repomd)
+        return repomd
+
+
+# shared by all bots of a process so the state survives between polls
+cache = RepomdCache()
@@ -5,14 +5,18 @@ import requests
 
 
 from gzip import decompress
+from urllib.error import HTTPError
 from xml.etree import cElementTree as ET
 import osc.core
 
 from osclib.memoize import memoize
+from oqamaint import repomd
 
 
 class Update(object):
     incident_name_cache = {}
+    # updateinfo location -> patch id, the location contains the checksum
+    patch_id_cache = {}
 
     def __init__(self, settings):
         self._settings = settings
@@ -25,14 +29,15 @@ class Update(object):
         max_revision = 0
         for channel in job['channels']:
             crepo = repo + '/' + channel.replace(':', '_')
-            xml = requests.get(crepo + '/repodata/repomd.xml')
-            if not xml.ok:
+            try:
+                rev = repomd.cache.get(crepo).revision
+            except HTTPError:
+                rev = None
+            if rev is None:
                 self.logger.info("{} skipped .. need wait".format(crepo))
                 # if one fails, we skip it and wait
                 return False
-            root = ET.fromstring(xml.text)
-            rev = root.find('.//{http://linux.duke.edu/metadata/repo}revision')
-            rev = int(rev.text)
+            rev = int(rev)
             if rev > max_revision:
                 max_revision = rev
         return max_revision
@@ -72,22 +77,19 @@ class Update(object):
     # grab the updateinfo from the given repo and return its patch's id
     @staticmethod
     def patch_id(repo):
-        url = repo + 'repodata/repomd.xml'
-        repomd = requests.get(url)
-        if not repomd.ok:
-            return None
-        root = ET.fromstring(repomd.text)
-
-        cs = root.find(
-            './/{http://linux.duke.edu/metadata/repo}data[@type="updateinfo"]/{http://linux.duke.edu/metadata/repo}location')
         try:
-            url = repo + cs.attrib['href']
-        except AttributeError:
+            href = repomd.cache.get(repo).locations.get('updateinfo')
+        except HTTPError:
+            return None
+        if not href:
             return None
 
-        repomd = requests.get(url).content
-        root = ET.fromstring(decompress(repomd))
-        return root.find('.//id').text
+        url = repo + href
+        if url not in Update.patch_id_cache:
+            content = requests.get(url).content
+            root = ET.fromstring(decompress(content))
+            Update.patch_id_cache[url] = root.find('.//id').text
+        return Update.patch_id_cache[url]
 
     # take the first package name we find - often enough correct
     def incident_name(self, prj):
@@ -119,6 +119,8 @@ def clean_args(args):
 @cmdln.option('--strategy', help='apply a specific strategy')
 @cmdln.option('--no-color', action='store_true', help='strip colors from output (or add staging.color = 0 to the .oscrc general section')
 @cmdln.option('--save', action='store_true', help='save the result to the pseudometa package')
+@cmdln.option('--lock-wait', type=int, default=0, metavar='SECONDS',
+              help='wait up to SECONDS for the staging lock to be released instead of failing')
 def do_staging(self, subcmd, opts, *args):
     """${cmd_name}: Commands to work with staging projects
 
@@ -139,7 +141,8 @@ def do_staging(self, subcmd, opts, *args):
     "check_duplicate_binaries" list binaries provided by multiple packages
 
     "cleanup_rings" will try to cleanup rings content and print
-        out problems
+        out problems. When packages are given, show what else could be
+        removed from the rings if those packages were gone.
 
     "freeze" will freeze the sources of the project's links while not
         affecting the source packages
@@ -297,7 +300,7 @@ def do_staging(self, subcmd, opts, *args):
         osc staging check [STAGING...]
         osc staging check_duplicate_binaries
         osc staging check_local_links
-        osc staging cleanup_rings
+        osc staging cleanup_rings [PACKAGE...]
         osc staging freeze [--no-bootstrap] STAGING...
         osc staging frozenage [STAGING...]
         osc staging ignore [-m MESSAGE] REQUEST...
@@ -336,6 +339,7 @@ def do_staging(self, subcmd, opts, *args):
         'rebuild',
         'repair',
         'supersede',
+        'cleanup_rings',
     ):
         min_args, max_args = 0, None
     elif cmd in (
@@ -347,7 +351,6 @@ def do_staging(self, subcmd, opts, *args):
     elif cmd in (
         'check_duplicate_binaries',
         'check_local_links',
-        'cleanup_rings',
         'list',
         'lock',
         'unlock',
@@ -394,7 +397,10 @@ def do_staging(self, subcmd, opts, *args):
 
     api = StagingAPI(opts.apiurl, opts.project)
     needed = lock_needed(cmd, opts)
-    with OBSLock(opts.apiurl, opts.project, reason=cmd, needed=needed) as lock:
+    # Long running commands keep renewing the lock so it does not expire.
+    lease = cmd in ('accept', 'select')
+    with OBSLock(opts.apiurl, opts.project, reason=cmd, needed=needed,
+                 wait=opts.lock_wait, lease=lease) as lock:
 
         # call the respective command and parse args by need
         if cmd == 'check':
@@ -566,7 +572,7 @@ def do_staging(self, subcmd, opts, *args):
                     .perform(requests, opts.move,
                              filter_from, opts.no_freeze)
         elif cmd == 'cleanup_rings':
-            CleanupRings(api).perform()
+            CleanupRings(api).perform(args[1:])
         elif cmd == 'ignore':
             IgnoreCommand(api).perform(args[1:], opts.message)
         elif cmd == 'unignore':
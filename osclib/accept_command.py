@@ -1,6 +1,7 @@
 import re
 import time
 
+from concurrent.futures import ThreadPoolExecutor
 from urllib.error import HTTPError
 
 import warnings
@@ -18,6 +19,12 @@ from osclib.core import source_file_save
 from osclib.request_finder import RequestFinder
 from datetime import date
 
+# number of packages whose links are fixed concurrently
+FIX_LINKS_WORKERS = 8
+# poll interval bounds while waiting for stagings to be accepted
+ACCEPT_POLL_MIN = 1
+ACCEPT_POLL_MAX = 30
+
 
 class AcceptCommand(object):
     def __init__(self, api):
@@ -115,16 +122,7 @@ class AcceptCommand(object):
             print(f"Accepting request {req['id']}: {req['package']}")
             change_request_state(self.api.apiurl, str(req['id']), 'accepted', message='Accept to %s' % self.api.project)
 
-        for project in sorted(staging_packages.keys()):
-            print(f'waiting for staging project {project} to be accepted')
-
-            while True:
-                status = self.api.project_status(project, reload=True)
-                if status.get('state') == 'empty':
-                    break
-                print('{} requests still staged - waiting'.format(status.find('staged_requests').get('count')))
-                time.sleep(1)
-
+        for project in self.wait_for_accepted(staging_packages.keys()):
             self.api.accept_status_comment(project, staging_packages[project])
             if self.api.is_adi_project(project):
                 self.api.delete_empty_adi_project(project)
@@ -137,8 +135,7 @@ class AcceptCommand(object):
             if cleanup:
                 self.cleanup(project)
 
-        for package in self.requests['submit']:
-            self.fix_linking_packages(package)
+        self.fix_linking_packages_all(self.requests['submit'])
 
         if self.api.project.startswith('openSUSE:'):
             self.update_factory_version()
@@ -147,6 +144,50 @@ class AcceptCommand(object):
 
         return True
 
+    def wait_for_accepted(self, projects):
+        """
+        Yield staging projects as soon as they are empty.
+
+        The status of all stagings is polled with a single request and the
+        interval backs off while nothing changes. A staging missing from the
+        status is an error instead of being waited for forever.
+        """
+        pending = set(projects)
+        for project in sorted(pending):
+            print(f'waiting for staging project {project} to be accepted')
+
+        delay = ACCEPT_POLL_MIN
+        while pending:
+            done = []
+            listed = set()
+            staged = 0
+            for status in self.api.project_status(None, reload=True):
+                project = status.get('name')
+                if project not in pending:
+                    continue
+                listed.add(project)
+                if status.get('state') == 'empty':
+                    done.append(project)
+                else:
+                    staged += int(status.find('staged_requests').get('count'))
+
+            missing = pending - listed
+            if missing:
+                raise Exception('staging projects not found: {}'.format(', '.join(sorted(missing))))
+
+            for project in sorted(done):
+                pending.remove(project)
+                yield project
+
+            if not pending:
+                break
+
+            if done:
+                delay = ACCEPT_POLL_MIN
+            print('{} requests still staged in {} projects - waiting'.format(staged, len(pending)))
+            time.sleep(delay)
+            delay = min(delay * 2, ACCEPT_POLL_MAX)
+
     def cleanup(self, project):
         if not self.api.item_exists(project):
             return
@@ -161,10 +202,41 @@ class AcceptCommand(object):
         return
 
     def check_local_links(self):
-        for package in meta_get_packagelist(self.api.apiurl, self.api.project):
-            self.fix_linking_packages(package, True)
+        self.fix_linking_packages_all(meta_get_packagelist(self.api.apiurl, self.api.project), True)
+
+    def local_links(self):
+        """
+        Map of package -> set of packages in the project linking to it.
+
+        Replaces a showlinked call per package by a single sourceinfo request.
+        """
+        project = self.api.project
+        url = self.api.makeurl(['source', project], { 'view': 'info', 'nofilename': '1' })
+        root = ET.parse(http_GET(url)).getroot()
+        links = {}
+        for si in root.findall('sourceinfo'):
+            linked = si.find('linked')
+            if linked is not None and linked.get('project') == project:
+                links.setdefault(linked.get('package'), set()).add(si.get('package'))
+        return links
+
+    def fix_linking_packages_all(self, packages, dry=False):
+        if not packages:
+            return
+
+        local_links = self.local_links()
+        # resolve lazily loaded data before the workers use it
+        self.api.ring_packages
 
-    def fix_linking_packages(self, package, dry=False):
+        def fix(package):
+            self.fix_linking_packages(package, dry, local_links.get(package, set()))
+
+        with ThreadPoolExecutor(max_workers=FIX_LINKS_WORKERS) as executor:
+            # consume the results to propagate exceptions
+            for _ in executor.map(fix, packages):
+                pass
+
+    def fix_linking_packages(self, package, dry=False, local_links=None):
         project = self.api.project
         file_list = self.api.get_filelist_for_package(package, project)
         # ignore linked packages
@@ -178,10 +250,11 @@ class AcceptCommand(object):
             for file in file_list:
                 if file.endswith('.spec') and file != f'{package}.spec':
                     needed_links.add(file[:-5])
-        local_links = set()
-        for link in self.api.linked_packages(package):
-            if link['project'] == project:
-                local_links.add(link['package'])
+        if local_links is None:
+            local_links = set()
+            for link in self.api.linked_packages(package):
+                if link['project'] == project:
+                    local_links.add(link['package'])
 
         # Deleting all the packages that no longer have a .spec file
         for link in local_links - needed_links:
@@ -1,9 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
 from xml.etree import cElementTree as ET
 
 from osc.core import makeurl
 from osc.core import http_GET
-from osclib.core import fileinfo_ext_all
+from osclib.core import fileinfo_ext
 from osclib.core import builddepinfo
+from osclib.core import package_binary_list
 
 try:
     from urllib.error import HTTPError
@@ -11,10 +13,53 @@ except ImportError:
     #python 2.x
     from urllib2 import HTTPError
 
+# number of concurrent fileinfo_ext requests
+FILEINFO_WORKERS = 8
+
+class DependencyGraph(object):
+    """Source level dependency graph of the rings.
+
+    Every source maps to the set of nodes referencing it. These are either
+    other sources (build or runtime dependencies) or pseudo nodes such as
+    MYinstall for buildconfig and MYdvd<n> for images. Once the graph is filled
+    all questions are answered locally.
+    """
+
+    def __init__(self):
+        self.bin2src = {}
+        self.users = {}
+        self.requiredby_loaded = set()
+
+    def reference(self, source, user):
+        self.users.setdefault(source, set()).add(user)
+
+    def referenced(self, source, removed=frozenset()):
+        return any(user not in removed for user in self.users.get(source, ()))
+
+    def removal_impact(self, removed, keep=()):
+        """Sources that lose their last reference when removed are deleted.
+
+        Repeated until nothing changes, so chains of packages only needed by
+        removed ones are included.
+        """
+        removed = set(removed)
+        impact = set()
+        changed = True
+        while changed:
+            changed = False
+            for source, users in self.users.items():
+                if source in removed or source in keep:
+                    continue
+                if not self.referenced(source, removed):
+                    removed.add(source)
+                    impact.add(source)
+                    changed = True
+        return impact
+
 class CleanupRings(object):
     def __init__(self, api):
-        self.bin2src = {}
-        self.pkgdeps = {}
+        self.graph = DependencyGraph()
+        self.bin2src = self.graph.bin2src
         self.sources = set()
         self.api = api
         self.links = {}
@@ -25,7 +70,10 @@ class CleanupRings(object):
             'kernel-syms',
         ]
 
-    def perform(self):
+    def perform(self, what_if=None):
+        if what_if:
+            return self.perform_what_if(what_if)
+
         for index, ring in enumerate(self.api.rings):
             print('# {}'.format(ring))
             ring_next = self.api.rings[index + 1] if index + 1 < len(self.api.rings) else None
@@ -33,6 +81,27 @@ class CleanupRings(object):
 
         print('\n'.join(self.commands))
 
+    def perform_what_if(self, packages):
+        """Print what else could go if packages were removed from the rings."""
+        ring_sources = {}
+        for ring in self.api.rings:
+            if not self.repo_state_acceptable(ring):
+                return False
+            self.fill_ring(ring)
+            ring_sources[ring] = self.sources
+            self.sources = set()
+
+        for ring, sources in ring_sources.items():
+            self.fill_requiredby(ring, sources, complete=True)
+
+        keep = set(self.links) | set(self.whitelist)
+        impact = self.graph.removal_impact(packages, keep)
+        for ring, sources in ring_sources.items():
+            print('# {}'.format(ring))
+            for source in sorted(impact & sources):
+                print('# - {}'.format(source))
+        return True
+
     def find_inner_ring_links(self, prj):
         query = {
             'view': 'info',
@@ -103,7 +172,7 @@ class CleanupRings(object):
                         print('Package {} not found in place'.format(pkg.text))
                     continue
                 b = self.bin2src[pkg.text]
-                self.pkgdeps[b] = name
+                self.graph.reference(b, name)
 
     def repo_state_acceptable(self, project):
         url = makeurl(self.api.apiurl, ['build', project, '_result'])
@@ -137,7 +206,7 @@ class CleanupRings(object):
                     print("{} not found in bin2src".format(b))
                     continue
                 b = self.bin2src[b]
-                self.pkgdeps[b] = 'MYdvd{}'.format(self.api.rings.index(project))
+                self.graph.reference(b, 'MYdvd{}'.format(self.api.rings.index(project)))
             break
 
     def check_buildconfig(self, project):
@@ -149,25 +218,54 @@ class CleanupRings(object):
                     if prein not in self.bin2src:
                         continue
                     b = self.bin2src[prein]
-                    self.pkgdeps[b] = 'MYinstall'
+                    self.graph.reference(b, 'MYinstall')
+
+    def fill_requiredby(self, project, packages, complete=False):
+        """Add runtime reverse dependencies of packages to the graph.
+
+        The binary lists of all archs are fetched once and the packages are
+        checked concurrently. Unless complete is set the binaries of a package
+        are only checked until the first reverse dependency is found, which is
+        enough to know it is still needed.
+        """
+        packages = set(packages)
+        if complete:
+            packages -= self.graph.requiredby_loaded
+            self.graph.requiredby_loaded.update(packages)
+        if not packages:
+            return
 
-    def check_requiredby(self, project, package):
         # Prioritize x86_64 bit.
+        binaries = {}
         for arch in reversed(self.api.cstaging_archs):
-            for fileinfo in fileinfo_ext_all(self.api.apiurl, project, 'standard', arch, package):
+            binary_list, _ = package_binary_list(self.api.apiurl, project, 'standard', arch,
+                                                 strip_multibuild=False, exclude_src_debug=True)
+            for binary in binary_list:
+                source = binary.package.split(':')[0]
+                if source in packages:
+                    binaries.setdefault(source, []).append(
+                        (arch, binary.package, binary.filename + '.rpm'))
+
+        def fetch(source):
+            required = set()
+            for arch, package, filename in binaries.get(source, []):
+                fileinfo = fileinfo_ext(self.api.apiurl, project, 'standard', arch, package, filename)
                 for requiredby in fileinfo.findall('provides_ext/requiredby[@name]'):
-                    b = self.bin2src[requiredby.get('name')]
-                    if b == package:
-                        # A subpackage depending on self.
+                    b = self.bin2src.get(requiredby.get('name'))
+                    if b is None or b == source:
+                        # Unknown or a subpackage depending on self.
                         continue
-                    self.pkgdeps[package] = b
-                    return True
-        return False
+                    required.add(b)
+                if required and not complete:
+                    break
+            return source, required
 
-    def check_depinfo_ring(self, prj, nextprj):
-        if not self.repo_state_acceptable(prj):
-            return False
+        with ThreadPoolExecutor(max_workers=FILEINFO_WORKERS) as executor:
+            for source, required in executor.map(fetch, sorted(packages)):
+                for b in required:
+                    self.graph.reference(source, b)
 
+    def fill_ring(self, prj):
         self.find_inner_ring_links(prj)
         for arch in self.api.cstaging_archs:
             self.fill_pkgdeps(prj, 'standard', arch)
@@ -178,21 +276,33 @@ class CleanupRings(object):
             for arch in self.api.cstaging_archs:
                 self.check_image_bdeps(prj, arch)
 
+    def check_depinfo_ring(self, prj, nextprj):
+        if not self.repo_state_acceptable(prj):
+            return False
+
+        self.fill_ring(prj)
+
+        candidates = set()
         for source in self.sources:
-            if (source not in self.pkgdeps and
+            if (not self.graph.referenced(source) and
                 source not in self.links and
                 source not in self.whitelist):
                 if source.startswith('texlive-specs-'): # XXX: texlive bullshit packaging
                     continue
-                # Expensive check so left until last.
-                if self.check_requiredby(prj, source):
-                    continue
+                candidates.add(source)
 
-                print('# - {}'.format(source))
-                self.commands.append('osc rdelete -m cleanup {} {}'.format(prj, source))
-                if nextprj:
-                    self.commands.append('osc linkpac {} {} {}'.format(self.api.project, source, nextprj))
+        # Runtime dependencies only matter for otherwise unreferenced packages.
+        self.fill_requiredby(prj, candidates)
+
+        for source in sorted(candidates):
+            if self.graph.referenced(source):
+                continue
+
+            print('# - {}'.format(source))
+            self.commands.append('osc rdelete -m cleanup {} {}'.format(prj, source))
+            if nextprj:
+                self.commands.append('osc linkpac {} {} {}'.format(self.api.project, source, nextprj))
 
         # Only loop through sources once from their origin ring to ensure single
-        # step moving to allow check_requiredby() to see result in each ring.
+        # step moving to allow the requiredby data to see result in each ring.
         self.sources = set()
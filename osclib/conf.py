@@ -3,12 +3,16 @@ from __future__ import print_function
 from osc import OscConfigParser
 from collections import OrderedDict
 import io
+import json
 import os
 import operator
 import re
 
 from osc import conf
+from osclib.cache_manager import CacheManager
 from osclib.memoize import memoize
+from time import time
+from urllib.parse import urlsplit
 
 
 # Sane defaults for openSUSE and SUSE.  The string interpolation rule
@@ -179,6 +183,10 @@ DEFAULT = {
 # lock = openSUSE:Factory:Staging
 #
 
+# Seconds a cached remote config is used without asking the server whether it
+# changed.
+REMOTE_CACHE_TTL = 5 * 60
+
 
 def str2bool(v):
     return (v is not None and v.lower() in ("yes", "true", "t", "1"))
@@ -189,7 +197,7 @@ class Config(object):
 
     def __init__(self, apiurl, project):
         self.project = project
-        self.remote_values = self.fetch_remote(apiurl)
+        self.remote_values = self.fetch_remote_cached(apiurl)
 
         conf_file = conf.config.get('conffile', os.environ.get('OSC_CONFIG', '~/.oscrc'))
         self.conf_file = os.path.expanduser(conf_file)
@@ -252,9 +260,53 @@ class Config(object):
         else:
             return defaults
 
+    @staticmethod
+    def remote_cache_path(apiurl, project):
+        return os.path.join(CacheManager.directory('config', urlsplit(apiurl).hostname),
+                            project + '.json')
+
+    @staticmethod
+    def remote_cache_delete(apiurl, project):
+        path = Config.remote_cache_path(apiurl, project)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def fetch_remote_cached(self, apiurl):
+        """
+        Load the remote config from the local cache. Once it is older than
+        REMOTE_CACHE_TTL a conditional request on the ETag of the attribute
+        tells whether it is still current.
+        """
+        from osclib.core import attribute_value_load_etag
+
+        path = self.remote_cache_path(apiurl, self.project)
+        cached = None
+        if os.path.exists(path):
+            with open(path) as f:
+                try:
+                    cached = json.load(f)
+                except ValueError:
+                    pass
+        if cached and time() - os.path.getmtime(path) <= REMOTE_CACHE_TTL:
+            return cached['remote']
+
+        modified, config, etag = attribute_value_load_etag(
+            apiurl, self.project, 'Config', cached.get('etag') if cached else None)
+        if not modified:
+            os.utime(path, None)
+            return cached['remote']
+
+        remote = self.parse_remote(config)
+        with open(path + '.new', 'w') as f:
+            json.dump({'etag': etag, 'remote': remote}, f)
+        os.rename(path + '.new', path)
+        return remote
+
     def fetch_remote(self, apiurl):
         from osclib.core import attribute_value_load
-        config = attribute_value_load(apiurl, self.project, 'Config')
+        return self.parse_remote(attribute_value_load(apiurl, self.project, 'Config'))
+
+    def parse_remote(self, config):
         if config:
             cp = OscConfigParser.OscConfigParser()
             config = u'[remote]\n' + config
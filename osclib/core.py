@@ -26,6 +26,7 @@ from osc.core import show_project_meta
 from osc.core import show_results_meta
 from osc.core import xpath_join
 from osc.util.helper import decode_it
+import osc.core
 from osc import conf
 from osclib.conf import Config
 from osclib.memoize import memoize
@@ -363,6 +364,26 @@ def package_list_kind_filtered(apiurl, project, kinds_allowed=['source']):
 
         yield package
 
+def http_GET_etag(url, etag=None):
+    """GET url unless it still matches etag.
+
+    Returns (modified, f, etag) where f is only set if modified. The request
+    bypasses the osclib Cache which neither answers conditional requests nor
+    keeps the response headers.
+    """
+    headers = {'If-None-Match': etag} if etag else {}
+    http_request = getattr(osc.core, '_http_request', osc.core.http_request)
+
+    try:
+        f = http_request('GET', url, headers)
+    except HTTPError as e:
+        if e.code == 304 and etag:
+            return False, None, etag
+
+        raise e
+
+    return True, f, f.headers.get('ETag')
+
 def attribute_value_load(apiurl, project, name, namespace='OSRT', package=None):
     path = list(filter(None, ['source', project, package, '_attribute', namespace + ':' + name]))
     url = makeurl(apiurl, path)
@@ -375,6 +396,30 @@ def attribute_value_load(apiurl, project, name, namespace='OSRT', package=None):
 
         raise e
 
+    return attribute_value_parse(root, name, namespace)
+
+def attribute_value_load_etag(apiurl, project, name, etag, namespace='OSRT', package=None):
+    """Load an attribute value unless it still matches etag.
+
+    Returns (modified, value, etag) where value is only set if modified.
+    """
+    path = list(filter(None, ['source', project, package, '_attribute', namespace + ':' + name]))
+    url = makeurl(apiurl, path)
+
+    try:
+        modified, f, etag = http_GET_etag(url, etag)
+    except HTTPError as e:
+        if e.code == 404:
+            return True, None, None
+
+        raise e
+
+    if not modified:
+        return False, None, etag
+
+    return True, attribute_value_parse(ETL.parse(f).getroot(), name, namespace), etag
+
+def attribute_value_parse(root, name, namespace='OSRT'):
     xpath_base = './attribute[@namespace="{}" and @name="{}"]'.format(namespace, name)
     value = root.xpath('{}/value/text()'.format(xpath_base))
     if not len(value):
@@ -404,10 +449,17 @@ def attribute_value_save(apiurl, project, name, value, namespace='OSRT', package
     # The OBS API of attributes is super strange, POST to update.
     url = makeurl(apiurl, list(filter(None, ['source', project, package, '_attribute'])))
     http_POST(url, data=ET.tostring(root))
+    attribute_value_changed(apiurl, project, name, namespace, package)
 
 def attribute_value_delete(apiurl, project, name, namespace='OSRT', package=None):
     http_DELETE(makeurl(
         apiurl, list(filter(None, ['source', project, package, '_attribute', namespace + ':' + name]))))
+    attribute_value_changed(apiurl, project, name, namespace, package)
+
+def attribute_value_changed(apiurl, project, name, namespace, package):
+    if namespace == 'OSRT' and name == 'Config' and not package:
+        # Do not wait for the project statistics to reflect the change.
+        Config.remote_cache_delete(apiurl, project)
 
 @memoize(session=True)
 def _repository_path_expand(apiurl, project, repo):
@@ -1,60 +1,143 @@
 #!/usr/bin/python3
 
+import io
 import struct
 
+MAGIC = b'070701'
+HEADER_FMT = '6s8s8s8s8s8s8s8s8s8s8s8s8s8s'
+HEADER_SIZE = struct.calcsize(HEADER_FMT)
+HEADER_NAMES = ("c_ino", "c_mode", "c_uid", "c_gid",
+                "c_nlink", "c_mtime", "c_filesize",
+                "c_devmajor", "c_devminor", "c_rdevmajor",
+                "c_rdevminor", "c_namesize", "c_check")
+TRAILER = 'TRAILER!!!'
+SKIP_CHUNK = 64 * 1024
+
+
+def padding(off):
+    return (4 - (off & 3)) & 3
+
 class Cpio(object):
+    """
+    Iterate the members of a newc cpio archive.
+
+    buf is either an object supporting the buffer protocol (bytes, mmap, ...)
+    in which case member payloads are memoryviews into it, or a file object
+    that is read sequentially. Payloads of members that are not read are
+    skipped, by seeking if the file supports it.
+    """
+
     def __init__(self, buf):
-        self.buf = buf
+        try:
+            self.buf = memoryview(buf)
+            self.fh = None
+        except TypeError:
+            self.buf = None
+            self.fh = buf
         self.off = 0
+        self.current = None
 
     def __iter__(self):
         return self
 
-    def next(self):
-        f = CpioFile(self.off, self.buf)
+    def __next__(self):
+        if self.current is not None:
+            self.current.skip()
+            self.current = None
+
+        f = CpioFile(self)
         if f.fin():
             raise StopIteration
-        self.off = self.off + f.length()
+        self.current = f
         return f
 
-class CpioFile(object):
-    def __init__(self, off, buf):
-        self.off = off
-        self.buf = buf
+    next = __next__
+
+    def _read(self, size):
+        if self.buf is not None:
+            data = self.buf[self.off:self.off + size]
+        else:
+            data = self.fh.read(size)
+        if len(data) != size:
+            raise Exception("truncated cpio archive at offset %d" % self.off)
+        self.off += size
+        return data
+
+    def _skip(self, size):
+        if self.buf is not None:
+            self.off += size
+            return
+
+        seekable = getattr(self.fh, 'seekable', None)
+        if seekable and seekable():
+            self.fh.seek(size, io.SEEK_CUR)
+            self.off += size
+            return
+
+        while size:
+            chunk = self._read(min(size, SKIP_CHUNK))
+            size -= len(chunk)
 
-        if (off & 3):
-            raise Exception("invalid offset %d" % off)
+class CpioFile(object):
+    def __init__(self, archive):
+        self.archive = archive
+        self.off = archive.off
 
-        fmt = "6s8s8s8s8s8s8s8s8s8s8s8s8s8s"
-        off = self.off + struct.calcsize(fmt)
+        if (self.off & 3):
+            raise Exception("invalid offset %d" % self.off)
 
-        fields = struct.unpack(fmt, buf[self.off:off])
+        fields = struct.unpack(HEADER_FMT, archive._read(HEADER_SIZE))
 
-        if fields[0] != "070701":
+        self.c_magic = bytes(fields[0])
+        if self.c_magic != MAGIC:
             raise Exception("invalid cpio header %s" % self.c_magic)
 
-        names = ("c_ino", "c_mode", "c_uid", "c_gid",
-                "c_nlink", "c_mtime", "c_filesize",
-                "c_devmajor", "c_devminor", "c_rdevmajor",
-                "c_rdevminor", "c_namesize", "c_check")
-        for (n, v) in zip(names, fields[1:]):
+        for (n, v) in zip(HEADER_NAMES, fields[1:]):
             setattr(self, n, int(v, 16))
 
-        nlen = self.c_namesize - 1
-        self.name = struct.unpack('%ds' % nlen, buf[off:off + nlen])[0]
-        off = off + nlen + 1
-        if (off & 3):
-            off = off + 4 - (off & 3)   # padding
-        self.payloadstart = off
+        name = archive._read(self.c_namesize)
+        self.name = bytes(name[:-1]).decode('utf-8', 'surrogateescape')
+        archive._skip(padding(archive.off))
+
+        self.payloadstart = archive.off
+        self.remaining = self.c_filesize
 
     def fin(self):
-        return self.name == 'TRAILER!!!'
+        return self.name == TRAILER
 
     def __str__(self):
         return "[%s %d]" % (self.name, self.c_filesize)
 
+    def payload(self):
+        """
+        Zero copy view of the payload, only available when reading from a
+        buffer.
+        """
+        if self.archive.buf is None:
+            raise Exception("payload views need a buffer, use read() on streams")
+        return self.archive.buf[self.payloadstart:self.payloadstart + self.c_filesize]
+
+    def read(self, size=-1):
+        """Read from the payload, never beyond its end."""
+        if self.archive.current is not self:
+            raise Exception("%s is no longer the current member" % self.name)
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.archive._read(size)
+        self.remaining -= size
+        return bytes(data)
+
+    def skip(self):
+        """Skip the unread part of the payload and the padding."""
+        if self.archive.current is not self:
+            return
+        self.archive._skip(self.remaining + padding(self.c_filesize))
+        self.remaining = 0
+
     def header(self):
-        return self.buf[self.payloadstart:self.payloadstart + self.c_filesize]
+        if self.archive.buf is not None:
+            return self.payload()
+        return self.read()
 
     def length(self):
         l = self.payloadstart - self.off + self.c_filesize
@@ -72,10 +155,12 @@ if __name__ == '__main__':
     (options, args) = parser.parse_args()
 
     for fn in args:
-        fh = open(fn, 'rb')
-        cpio = Cpio(fh.read())
-        for i in cpio:
-            print(i)
-            ofh = open(i.name, 'wb')
-            ofh.write(i.header())
-            ofh.close()
+        with open(fn, 'rb') as fh:
+            for i in Cpio(fh):
+                print(i)
+                with open(i.name, 'wb') as ofh:
+                    while True:
+                        data = i.read(SKIP_CHUNK)
+                        if not data:
+                            break
+                        ofh.write(data)
@@ -1,14 +1,16 @@
 from __future__ import print_function
 
 from datetime import datetime
+import random
+import threading
 import time
 import warnings
 from xml.etree import cElementTree as ET
 
 from osc import conf
 from osc.core import makeurl
-from osc.core import http_GET
 from osc.core import http_POST
+from osclib.core import http_GET_etag
 
 try:
     from urllib.error import HTTPError
@@ -16,10 +18,20 @@ except ImportError:
     # python 2.x
     from urllib2 import HTTPError
 
+# Bounds of the delay in seconds between attempts to acquire a taken lock.
+WAIT_DELAY_MIN = 2
+WAIT_DELAY_MAX = 60
+
 class OBSLock(object):
-    """Implement a distributed lock using a shared OBS resource."""
+    """Implement a distributed lock using a shared OBS resource.
+
+    With wait a taken lock is polled (conditional GET, exponential backoff
+    with jitter) for up to wait seconds instead of giving up right away. With
+    lease the signature of a held lock is refreshed in the background so long
+    running commands do not exceed the ttl.
+    """
 
-    def __init__(self, apiurl, project, ttl=3600, reason=None, needed=True):
+    def __init__(self, apiurl, project, ttl=3600, reason=None, needed=True, wait=0, lease=False):
         self.apiurl = apiurl
         self.project = project
         self.lock = conf.config[project]['lock']
@@ -31,6 +43,13 @@ class OBSLock(object):
         self.reason_sub = None
         self.locked = False
         self.needed = needed
+        self.wait = wait
+        self.lease = lease
+        self.lease_stop = None
+        # serializes the lease thread with reads and writes of the owner
+        self.lease_lock = threading.RLock()
+        self.read_etag = None
+        self.read_signature = None
 
     def _signature(self):
         """Create a signature with a timestamp."""
@@ -54,19 +73,29 @@ class OBSLock(object):
             pass
         return user, reason, reason_sub, ts
 
-    def _read(self):
+    def _read(self, conditional=False):
+        """Read the signature, with conditional reuse the last one if unchanged."""
+        with self.lease_lock:
+            return self._read_locked(conditional)
+
+    def _read_locked(self, conditional):
         url = makeurl(self.apiurl, ['source', self.lock, '_attribute', '%s:LockedBy' % self.ns])
         try:
-            root = ET.parse(http_GET(url)).getroot()
+            modified, f, etag = http_GET_etag(url, self.read_etag if conditional else None)
         except HTTPError as e:
             if e.code == 404:
                 return None
             raise e
+        if not modified:
+            return self.read_signature
+        root = ET.parse(f).getroot()
         signature = None
         try:
             signature = root.find('.//value').text
         except (AttributeError, ValueError):
             pass
+        self.read_etag = etag
+        self.read_signature = signature
         return signature
 
     def _write(self, signature):
@@ -77,7 +106,8 @@ class OBSLock(object):
             <value>%s</value>
           </attribute>
         </attributes>""" % (self.ns, signature)
-        http_POST(url, data=data)
+        with self.lease_lock:
+            http_POST(url, data=data)
 
     def acquire(self):
         if not self.needed: return self
@@ -88,7 +118,42 @@ class OBSLock(object):
             warnings.warn('Locking attribute is not found.  Create one to avoid race conditions.')
             return self
 
-        user, reason, reason_sub, ts = self._parse(self._read())
+        deadline = time.time() + self.wait
+        delay = WAIT_DELAY_MIN
+        conditional = False
+        while True:
+            blocked = self._blocked(self._read(conditional))
+            if not blocked:
+                break
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                print('Lock acquired by [%s] %s ago, reason <%s>. Try later.' % blocked)
+                exit(-1)
+
+            if not conditional:
+                print('Lock acquired by [%s] %s ago, reason <%s>. Waiting...' % blocked)
+            # Full jitter keeps waiting bots from polling in lockstep.
+            time.sleep(min(remaining, random.uniform(WAIT_DELAY_MIN, delay)))
+            delay = min(delay * 2, WAIT_DELAY_MAX)
+            conditional = True
+
+        self._write(self._signature())
+
+        time.sleep(1)
+        user, _, _, _ = self._parse(self._read())
+        if user != self.user:
+            raise Exception('Race condition, [%s] wins. Try later.' % user)
+        self.locked = True
+
+        if self.lease:
+            self._lease_start()
+
+        return self
+
+    def _blocked(self, signature):
+        """Return (user, age, reason) if the lock is held by someone else."""
+        user, reason, reason_sub, ts = self._parse(signature)
         if user and ts:
             now = datetime.utcnow()
             if now < ts:
@@ -107,17 +172,45 @@ class OBSLock(object):
                         stop = False
 
                 if stop:
-                    print('Lock acquired by [%s] %s ago, reason <%s>. Try later.' % (user, delta, reason))
-                    exit(-1)
-        self._write(self._signature())
+                    return user, delta, reason
+        return None
 
-        time.sleep(1)
+    def renew(self):
+        """Refresh the timestamp of a held lock, returns False if it was lost."""
         user, _, _, _ = self._parse(self._read())
         if user != self.user:
-            raise Exception('Race condition, [%s] wins. Try later.' % user)
-        self.locked = True
+            return False
+        self._write(self._signature())
+        return True
 
-        return self
+    def _lease_start(self):
+        if self.lease_stop:
+            return
+
+        self.lease_stop = threading.Event()
+        thread = threading.Thread(target=self._lease_run, args=(self.lease_stop,))
+        thread.daemon = True
+        thread.start()
+
+    def _lease_run(self, stop):
+        # Renew well before the ttl expires to survive a failed attempt.
+        while not stop.wait(self.ttl / 3):
+            try:
+                with self.lease_lock:
+                    if stop.is_set():
+                        return
+                    renewed = self.renew()
+                if not renewed:
+                    warnings.warn('Lock lost while holding lease.')
+                    return
+            except HTTPError as e:
+                warnings.warn('Failed to renew lock: {}'.format(e))
+
+    def _lease_end(self):
+        if self.lease_stop:
+            with self.lease_lock:
+                self.lease_stop.set()
+            self.lease_stop = None
 
     def release(self, force=False):
         if not force and not self.needed: return
@@ -127,6 +220,7 @@ class OBSLock(object):
         if not self.lock:
             return
 
+        self._lease_end()
         user, reason, reason_sub, _ = self._parse(self._read())
         clear = False
         if user == self.user:
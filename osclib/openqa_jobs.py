@@ -0,0 +1,75 @@
+from collections import OrderedDict
+import logging
+import time
+
+# jobs query parameter -> job setting it filters on
+SETTINGS = {
+    'arch': 'ARCH',
+    'build': 'BUILD',
+    'distri': 'DISTRI',
+    'flavor': 'FLAVOR',
+    'iso': 'ISO',
+    'machine': 'MACHINE',
+    'test': 'TEST',
+    'version': 'VERSION',
+}
+
+
+class OpenQAJobs(object):
+    """
+    Cached view of openQA's jobs API shared by the bots of a process.
+
+    Queries are cached by their parameters until they are invalidated, either
+    by an openQA job event or after ttl seconds. At most max_entries queries
+    are kept, the least recently used are dropped first.
+    """
+
+    def __init__(self, client, ttl=None, max_entries=None):
+        self.client = client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def _key(values):
+        return tuple(sorted((k, str(v)) for k, v in values.items()))
+
+    def _cached(self, key):
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        fetched, jobs = entry
+        if self.ttl is not None and time.time() - fetched > self.ttl:
+            del self.cache[key]
+            return None
+        self.cache.move_to_end(key)
+        return jobs
+
+    def jobs(self, values):
+        key = self._key(values)
+        jobs = self._cached(key)
+        if jobs is None:
+            jobs = self.client.openqa_request('GET', 'jobs', values)['jobs']
+            self.cache[key] = (time.time(), jobs)
+            if self.max_entries is not None:
+                while len(self.cache) > self.max_entries:
+                    self.cache.popitem(last=False)
+        return jobs
+
+    def invalidate(self, event=None):
+        """
+        Drop the cached queries an openQA job event (or posted ISO settings)
+        may affect. Without event everything is dropped.
+        """
+        if not event:
+            self.cache.clear()
+            return
+
+        for key in list(self.cache.keys()):
+            for param, value in key:
+                setting = SETTINGS.get(param)
+                if setting and setting in event and str(event[setting]) != value:
+                    break
+            else:
+                del self.cache[key]
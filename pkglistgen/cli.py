@@ -40,7 +40,7 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
         """
         return update_project(conf.config['apiurl'], project)
 
-    @cmdln.option('-f', '--force', action='store_true', help='continue even if build is in progress')
+    @cmdln.option('-f', '--force', action='store_true', help='continue even if build is in progress or inputs are unchanged')
     @cmdln.option('-p', '--project', help='target project')
     @cmdln.option('-s', '--scope', action='append', help='scope on which to operate ({}, staging:$letter)'.format(', '.join(SCOPES)))
     @cmdln.option('--no-checkout', action='store_true', help='reuse checkout in cache')
@@ -0,0 +1,142 @@
+import glob
+import logging
+import os
+import subprocess
+import threading
+
+from osc.core import HTTPError
+from osclib.core import repository_arch_state
+
+from pkglistgen import file_utils
+
+SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
+
+
+class SolvStore(object):
+    """
+    Process wide store of mirrored repositories and prepared pools.
+
+    The state of every repository is fetched and the repository mirrored at
+    most once per process, no matter how many repo chains (scopes, stagings)
+    include it. Prepared pools are handed out by key and stay alive as long
+    as an owner holds a reference to them.
+    """
+
+    def __init__(self, cachedir):
+        self.cachedir = cachedir
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.repo_locks = {}
+        self.states = {}
+        self.remote_states = {}
+        self.pools = {}
+
+    def solv_file(self, project, repo, arch):
+        return os.path.join(self.cachedir, 'repo-{}-{}-{}.solv'.format(project, repo, arch))
+
+    def state(self, project, repo, arch):
+        return self.states.get((project, repo, arch))
+
+    def remote_state(self, apiurl, project, repo, arch):
+        """
+        Return the state of the repository on the server as of the first call
+        in this process, None if it does not exist.
+        """
+        key = (project, repo, arch)
+        with self.lock:
+            if key in self.remote_states:
+                return self.remote_states[key]
+
+        try:
+            state = repository_arch_state(apiurl, project, repo, arch)
+        except HTTPError:
+            state = None
+
+        with self.lock:
+            return self.remote_states.setdefault(key, state)
+
+    def update_repo(self, apiurl, project, repo, arch):
+        """
+        Mirror a repository and regenerate its solv file if its state changed.
+
+        Returns True if the solv file was updated, None if the repository
+        does not exist.
+        """
+        key = (project, repo, arch)
+        with self.lock:
+            repo_lock = self.repo_locks.setdefault(key, threading.Lock())
+
+        with repo_lock:
+            # TODO: refactor to common function with repo_checker.py
+            d = os.path.join(self.cachedir, project, repo, arch)
+            if not os.path.exists(d):
+                os.makedirs(d)
+
+            # Fetch state before mirroring in-case it changes during download.
+            state = self.remote_state(apiurl, project, repo, arch)
+            if state is None:
+                return None
+
+            if self.states.get(key) == state:
+                return False
+
+            # Would be preferable to include hash in name, but cumbersome to handle without
+            # reworking a fair bit since the state needs to be tracked.
+            solv_file = self.solv_file(project, repo, arch)
+            solv_file_hash = '{}::{}'.format(solv_file, state)
+            if os.path.exists(solv_file) and os.path.exists(solv_file_hash):
+                # Solve file exists and hash unchanged, skip updating solv.
+                self.logger.debug('skipping solv generation for {} due to matching state {}'.format(
+                    '/'.join([project, repo, arch]), state))
+                self.states[key] = state
+                return False
+
+            # Either hash changed or new, so remove any old hash files.
+            file_utils.unlink_list(None, glob.glob(solv_file + '::*'))
+
+            self.logger.debug('updating %s', d)
+            args = [os.path.join(SCRIPT_PATH, '..', 'bs_mirrorfull')]
+            args.append('--nodebug')
+            args.append('{}/public/build/{}/{}/{}'.format(apiurl, project, repo, arch))
+            args.append(d)
+            p = subprocess.Popen(args, stdout=subprocess.PIPE)
+            for line in p.stdout:
+                self.logger.info(line.decode('utf-8').rstrip())
+            p.wait()
+
+            files = [os.path.join(d, f)
+                     for f in os.listdir(d) if f.endswith('.rpm')]
+            with open(solv_file, 'w') as fh:
+                p = subprocess.Popen(
+                    ['rpms2solv', '-m', '-', '-0'], stdin=subprocess.PIPE, stdout=fh)
+                p.communicate(bytes('\0'.join(files), 'utf-8'))
+                p.wait()
+
+            # Create hash file now that solv creation is complete.
+            open(solv_file_hash, 'a').close()
+            self.states[key] = state
+            return True
+
+    def pool(self, owner, key, create):
+        """
+        Return the pool stored under key, creating it with create() if needed,
+        and record owner as holding a reference.
+        """
+        with self.lock:
+            entry = self.pools.get(key)
+        if entry is None:
+            entry = (create(), set())
+            with self.lock:
+                entry = self.pools.setdefault(key, entry)
+        with self.lock:
+            entry[1].add(owner)
+        return entry[0]
+
+    def release(self, owner):
+        """Drop all references of owner and forget pools nobody holds."""
+        with self.lock:
+            for key in list(self.pools.keys()):
+                owners = self.pools[key][1]
+                owners.discard(owner)
+                if not owners:
+                    del self.pools[key]
@@ -1,5 +1,6 @@
 import ToolBase
 import glob
+import itertools
 import logging
 import os
 import re
@@ -10,34 +11,40 @@ import yaml
 import sys
 import tempfile
 
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree as ET
 
 from osc.core import checkout_package
 
 from osc.core import http_GET
-from osc.core import HTTPError
 from osc.core import show_results_meta
 from osc.core import Package
 from osc.core import undelete_package
 from osclib.core import attribute_value_load
+from osclib.core import package_source_hash
 from osclib.core import target_archs
 from osclib.conf import str2bool
 from osclib.core import repository_path_expand
-from osclib.core import repository_arch_state
 from osclib.cache_manager import CacheManager
+from osclib.util import sha1_short
 
 from urllib.parse import urlparse
 
 from pkglistgen import file_utils
 from pkglistgen.group import Group
-
-SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
+from pkglistgen.solv_store import SolvStore
 
 PRODUCT_SERVICE = '/usr/lib/obs/service/create_single_product'
 
 # share header cache with repochecker
 CACHEDIR = CacheManager.directory('repository-meta')
 
+# shared by all scopes solved by this process
+SOLV_STORE = SolvStore(CACHEDIR)
+
+# number of repositories mirrored concurrently
+UPDATE_REPOS_WORKERS = 4
+
 class PkgListGen(ToolBase.ToolBase):
 
     def __init__(self):
@@ -46,6 +53,7 @@ class PkgListGen(ToolBase.ToolBase):
         self.reset()
 
     def reset(self):
+        SOLV_STORE.release(self)
         # package -> supportatus
         self.packages = dict()
         self.groups = dict()
@@ -154,20 +162,40 @@ class PkgListGen(ToolBase.ToolBase):
     def expand_repos(self, project, repo='standard'):
         return repository_path_expand(self.apiurl, project, repo)
 
+    @staticmethod
+    def _solvable_nameids(pool):
+        # unique name ids of all solvables in the pool
+        return list(dict.fromkeys(s.nameid for s in pool.solvables_iter()))
+
+    @staticmethod
+    def _name_bitmap(pool, nameids, names):
+        # byte per name id, set for all names that are solvable names
+        bitmap = bytearray(max(nameids, default=0) + 1)
+        for name in names:
+            i = pool.str2id(name, False)
+            if i < len(bitmap):
+                bitmap[i] = 1
+        bitmap[0] = 0
+        return bitmap
+
+    @staticmethod
+    def _namespace_supplements(pool):
+        # names of solvables supplementing a modalias or filesystem namespace,
+        # also as part of rich dependencies
+        names = set()
+        for s in pool.solvables_iter():
+            for dep in s.lookup_deparray(solv.SOLVABLE_SUPPLEMENTS):
+                for d in dep.str().split(' '):
+                    if d.startswith('namespace:modalias') or d.startswith('namespace:filesystem'):
+                        names.add(s.name)
+        return names
+
     def _check_supplements(self):
         tocheck = set()
         tocheck_locales = set()
         for arch in self.filtered_architectures:
             pool = self.prepare_pool(arch, True)
-            sel = pool.Selection()
-            for s in pool.solvables_iter():
-                sel.add_raw(solv.Job.SOLVER_SOLVABLE, s.id)
-
-            for s in sel.solvables():
-                for dep in s.lookup_deparray(solv.SOLVABLE_SUPPLEMENTS):
-                    for d in dep.str().split(' '):
-                        if d.startswith('namespace:modalias') or d.startswith('namespace:filesystem'):
-                            tocheck.add(s.name)
+            tocheck.update(self._namespace_supplements(pool))
 
             for l in self.locales:
                 i = pool.str2id('locale({})'.format(l))
@@ -188,15 +216,25 @@ class PkgListGen(ToolBase.ToolBase):
             self.logger.warning('package %s provides supported locale but is not grouped', p)
 
     def prepare_pool(self, arch, ignore_conflicts):
+        # pools are only read after preparation, so all calls of a run and
+        # scopes with the same repo chain share them
+        chain = tuple((project, reponame, SOLV_STORE.state(project, reponame, arch))
+                      for project, reponame in self.repos)
+        key = (chain, arch, ignore_conflicts, tuple(sorted(self.locales)))
+        pool, self.lockjobs[arch] = SOLV_STORE.pool(
+            self, key, lambda: self._prepare_pool(arch, ignore_conflicts))
+        return pool
+
+    def _prepare_pool(self, arch, ignore_conflicts):
         pool = solv.Pool()
         pool.setarch(arch)
 
-        self.lockjobs[arch] = []
+        lockjobs = []
         solvables = set()
 
         for project, reponame in self.repos:
             repo = pool.add_repo(project)
-            s = os.path.join(CACHEDIR, 'repo-{}-{}-{}.solv'.format(project, reponame, arch))
+            s = SOLV_STORE.solv_file(project, reponame, arch)
             r = repo.add_solv(s)
             if not r:
                 if not self.did_update:
@@ -209,7 +247,7 @@ class PkgListGen(ToolBase.ToolBase):
                     solvable.unset(solv.SOLVABLE_OBSOLETES)
                 # only take the first solvable in the repo chain
                 if solvable.name in solvables:
-                    self.lockjobs[arch].append(pool.Job(solv.Job.SOLVER_SOLVABLE | solv.Job.SOLVER_LOCK, solvable.id))
+                    lockjobs.append(pool.Job(solv.Job.SOLVER_SOLVABLE | solv.Job.SOLVER_LOCK, solvable.id))
                 solvables.add(solvable.name)
 
         pool.addfileprovides()
@@ -218,7 +256,7 @@ class PkgListGen(ToolBase.ToolBase):
         for l in self.locales:
             pool.set_namespaceproviders(solv.NAMESPACE_LANGUAGE, pool.Dep(l), True)
 
-        return pool
+        return pool, lockjobs
 
     # parse file and merge all groups
     def _parse_unneeded(self, filename):
@@ -246,33 +284,19 @@ class PkgListGen(ToolBase.ToolBase):
 
         for arch in self.filtered_architectures:
             pool = self.prepare_pool(arch, False)
-            pool.Selection()
-            archpacks = [s.name for s in pool.solvables_iter()]
-
-            # copy
-            filtered = list(archpacks)
-            for r in uneeded_regexps:
-                filtered = [p for p in filtered if not r.match(p)]
-
-            # convert to set
-            filtered = set(filtered) - self.unwanted
-            for g in modules:
-                if unsorted and g == unsorted:
+            # work on name ids and only create strings for what is left over
+            nameids = self._solvable_nameids(pool)
+            grouped = self._name_bitmap(pool, nameids, itertools.chain.from_iterable(
+                g.solved_packages[a] for g in modules if g != unsorted for a in ('*', arch)))
+            archpacks = [pool.id2str(i) for i in nameids if not grouped[i]]
+
+            for package in archpacks:
+                if package in self.unwanted or any(r.match(package) for r in uneeded_regexps):
                     continue
-                for a in ('*', arch):
-                    filtered -= set(g.solved_packages[a])
-            for package in filtered:
                 packages.setdefault(package, []).append(arch)
 
             if unsorted:
-                archpacks = set(archpacks)
-                unsorted.solved_packages[arch] = dict()
-                for g in modules:
-                    archpacks -= set(g.solved_packages[arch])
-                    archpacks -= set(g.solved_packages['*'])
-                unsorted.solved_packages[arch] = dict()
-                for p in archpacks:
-                    unsorted.solved_packages[arch][p] = None
+                unsorted.solved_packages[arch] = dict.fromkeys(archpacks)
 
         if unsorted:
             common = None
@@ -315,60 +339,13 @@ class PkgListGen(ToolBase.ToolBase):
         return None
 
     def update_repos(self, architectures):
-        # only there to parse the repos
-        bs_mirrorfull = os.path.join(SCRIPT_PATH, '..', 'bs_mirrorfull')
-        global_update = False
-
-        for project, repo in self.repos:
-            for arch in architectures:
-                # TODO: refactor to common function with repo_checker.py
-                d = os.path.join(CACHEDIR, project, repo, arch)
-                if not os.path.exists(d):
-                    os.makedirs(d)
-
-                try:
-                    # Fetch state before mirroring in-case it changes during download.
-                    state = repository_arch_state(self.apiurl, project, repo, arch)
-                except HTTPError:
-                    continue
-
-                # Would be preferable to include hash in name, but cumbersome to handle without
-                # reworking a fair bit since the state needs to be tracked.
-                solv_file = os.path.join(CACHEDIR, 'repo-{}-{}-{}.solv'.format(project, repo, arch))
-                solv_file_hash = '{}::{}'.format(solv_file, state)
-                if os.path.exists(solv_file) and os.path.exists(solv_file_hash):
-                    # Solve file exists and hash unchanged, skip updating solv.
-                    self.logger.debug('skipping solv generation for {} due to matching state {}'.format(
-                        '/'.join([project, repo, arch]), state))
-                    continue
-
-                # Either hash changed or new, so remove any old hash files.
-                file_utils.unlink_list(None, glob.glob(solv_file + '::*'))
-                global_update = True
-
-                self.logger.debug('updating %s', d)
-                args = [bs_mirrorfull]
-                args.append('--nodebug')
-                args.append('{}/public/build/{}/{}/{}'.format(self.apiurl, project, repo, arch))
-                args.append(d)
-                p = subprocess.Popen(args, stdout=subprocess.PIPE)
-                for line in p.stdout:
-                    self.logger.info(line.decode('utf-8').rstrip())
-
-                files = [os.path.join(d, f)
-                         for f in os.listdir(d) if f.endswith('.rpm')]
-                fh = open(solv_file, 'w')
-                p = subprocess.Popen(
-                    ['rpms2solv', '-m', '-', '-0'], stdin=subprocess.PIPE, stdout=fh)
-                p.communicate(bytes('\0'.join(files), 'utf-8'))
-                p.wait()
-                fh.close()
-
-                # Create hash file now that solv creation is complete.
-                open(solv_file_hash, 'a').close()
+        # the base repositories of stagings are mirrored once per process
+        repos = [(project, repo, arch) for project, repo in self.repos for arch in architectures]
+        with ThreadPoolExecutor(max_workers=UPDATE_REPOS_WORKERS) as executor:
+            updated = list(executor.map(lambda r: SOLV_STORE.update_repo(self.apiurl, *r), repos))
         self.did_update = True
 
-        return global_update
+        return any(updated)
 
     def create_weakremovers(self, target, target_config, directory, output):
         drops = dict()
@@ -563,6 +540,48 @@ class PkgListGen(ToolBase.ToolBase):
             new_lines.append(line.replace('<version></version>', product_version))
         open(product_file, 'w').write(''.join(new_lines))
 
+    def input_fingerprint(self, api, project, target_config, scope, packages, only_release_packages):
+        """
+        Hash over everything a solve and the product service depend on: the
+        state of all repositories in the path, the sources of the input
+        packages, the pkglistgen config and the product version.
+        """
+        inputs = []
+        for repo_project, repo in self.repos:
+            for arch in self.filtered_architectures:
+                # reused by update_repos() instead of fetched again
+                state = SOLV_STORE.remote_state(api.apiurl, repo_project, repo, arch)
+                inputs.append('{}/{}/{}={}'.format(repo_project, repo, arch, state))
+
+        for package in packages:
+            inputs.append('{}={}'.format(package, package_source_hash(api.apiurl, project, package)))
+
+        for key in sorted(target_config.keys()):
+            if key.startswith('pkglistgen'):
+                inputs.append('{}={}'.format(key, target_config[key]))
+
+        inputs.append('version={}'.format(attribute_value_load(api.apiurl, project, 'ProductVersion')))
+        inputs.append('scope={}'.format(scope))
+        inputs.append('only_release_packages={}'.format(only_release_packages))
+        return sha1_short(inputs)
+
+    def fingerprint_file(self, api, project, scope):
+        host = urlparse(api.apiurl).hostname
+        return os.path.join(CacheManager.directory('pkglistgen-fingerprint', host),
+                            '{}-{}'.format(project, scope.replace(':', '-')))
+
+    def fingerprint_load(self, path):
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                return f.read().strip()
+        return None
+
+    def fingerprint_save(self, path, fingerprint):
+        if self.dry_run:
+            return
+        with open(path, 'w') as f:
+            f.write(fingerprint)
+
     def update_and_solve_target(self, api, target_project, target_config, main_repo,
                                 project, scope, force, no_checkout,
                                 only_release_packages, stop_after_solve):
@@ -601,6 +620,20 @@ class PkgListGen(ToolBase.ToolBase):
             print('{} undeleted, skip dvd until next cycle'.format(release))
             return
 
+        # make sure we only calculcate existant architectures
+        self.filter_architectures(target_archs(api.apiurl, project, main_repo))
+
+        # skip the whole solve if nothing it depends on changed since the last
+        # successful run
+        fingerprint_file = self.fingerprint_file(api, project, scope)
+        fingerprint = self.input_fingerprint(api, project, target_config, scope,
+                                             [group] + ([oldrepos] if drop_list else []),
+                                             only_release_packages)
+        if not force and not no_checkout and not stop_after_solve and \
+           self.fingerprint_load(fingerprint_file) == fingerprint:
+            print('{}: inputs unchanged since last run ({}), skipping'.format(project, fingerprint))
+            return
+
         # Cache dir specific to hostname and project.
         host = urlparse(api.apiurl).hostname
         cache_dir = CacheManager.directory('pkglistgen', host, project)
@@ -635,8 +668,6 @@ class PkgListGen(ToolBase.ToolBase):
         self.output_dir = product_dir
 
         print('-> do_update')
-        # make sure we only calculcate existant architectures
-        self.filter_architectures(target_archs(api.apiurl, project, main_repo))
         self.update_repos(self.filtered_architectures)
 
         if only_release_packages:
@@ -692,6 +723,7 @@ class PkgListGen(ToolBase.ToolBase):
         self.commit_package(release_dir)
 
         if only_release_packages:
+            self.fingerprint_save(fingerprint_file, fingerprint)
             return
 
         file_utils.multibuild_from_glob(product_dir, '*.kiwi')
@@ -728,3 +760,5 @@ class PkgListGen(ToolBase.ToolBase):
         if len(error_output) > 0:
             self.logger.error('Difference in yml:\n' + error_output.decode('utf-8'))
             return True
+
+        self.fingerprint_save(fingerprint_file, fingerprint)
@@ -1,18 +1,18 @@
 
 import glob
-import gzip
 import hashlib
-import io
+import json
 import logging
+import lzma
 import os.path
 import re
 import random
 import string
-import subprocess
 import sys
 import shutil
 import tempfile
 
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree as ET
 
 from osc import conf
@@ -30,6 +30,14 @@ from urllib.parse import urljoin, urlparse
 
 logger = logging.getLogger()
 
+DOWNLOAD_CHUNK = 1024 * 1024
+
+# number of repositories from config.yml processed concurrently
+UPDATE_WORKERS = 4
+
+# solv files of remote repositories keyed by their metadata checksum
+SOLV_CACHE = CacheManager.directory('update_repo_handler-solv')
+
 def dump_solv_build(baseurl):
     """Determine repo format and build string from remote repository."""
 
@@ -67,52 +75,76 @@ def dump_solv_build(baseurl):
 
     raise Exception(baseurl + 'includes no build number')
 
+def download(url, f, hasher=None):
+    """Stream url into f, without holding the body in memory."""
+    with requests.get(url, stream=True) as r:
+        if r.status_code != requests.codes.ok:
+            return False
+        for chunk in r.iter_content(DOWNLOAD_CHUNK):
+            if hasher:
+                hasher.update(chunk)
+            f.write(chunk)
+    f.flush()
+    os.lseek(f.fileno(), 0, os.SEEK_SET)
+    return True
+
+def repomd_primary(content):
+    ns = {'r': 'http://linux.duke.edu/metadata/repo'}
+    root = ET.fromstring(content)
+    primary_element = root.find('.//r:data[@type="primary"]', ns)
+    location = primary_element.find('r:location', ns).get('href')
+    sha256_expected = primary_element.find('r:checksum[@type="sha256"]', ns).text
+    return location, sha256_expected
+
+def repo_fingerprint(baseurl):
+    """Checksum of the package metadata of a repository, None if unknown."""
+    repomd = requests.get(urljoin(baseurl, 'repodata/repomd.xml'))
+    if repomd.status_code == requests.codes.ok:
+        return repomd_primary(repomd.content)[1]
+
+    content = requests.get(urljoin(baseurl, 'content'))
+    if content.status_code == requests.codes.ok:
+        return hashlib.sha256(content.content).hexdigest()
+
+    return None
+
 def parse_repomd(repo, baseurl):
     url = urljoin(baseurl, 'repodata/repomd.xml')
     repomd = requests.get(url)
     if repomd.status_code != requests.codes.ok:
         return False
 
-    ns = {'r': 'http://linux.duke.edu/metadata/repo'}
-    root = ET.fromstring(repomd.content)
-    primary_element = root.find('.//r:data[@type="primary"]', ns)
-    location = primary_element.find('r:location', ns).get('href')
-    sha256_expected = primary_element.find('r:checksum[@type="sha256"]', ns).text
+    location, sha256_expected = repomd_primary(repomd.content)
+
+    with tempfile.TemporaryFile() as f:
+        f.write(repomd.content)
+        f.flush()
+        os.lseek(f.fileno(), 0, os.SEEK_SET)
+        repo.add_repomdxml(solv.xfopen_fd(None, f.fileno()), 0)
 
-    f = tempfile.TemporaryFile()
-    f.write(repomd.content)
-    f.flush()
-    os.lseek(f.fileno(), 0, os.SEEK_SET)
-    repo.add_repomdxml(solv.xfopen_fd(None, f.fileno()), 0)
     url = urljoin(baseurl, location)
-    with requests.get(url, stream=True) as primary:
-        if primary.status_code != requests.codes.ok:
+    with tempfile.TemporaryFile() as f:
+        sha256 = hashlib.sha256()
+        if not download(url, f, sha256):
             raise Exception(url + ' does not exist')
-        sha256 = hashlib.sha256(primary.content).hexdigest()
-        if sha256 != sha256_expected:
-            raise Exception('checksums do not match {} != {}'.format(sha256, sha256_expected))
+        if sha256.hexdigest() != sha256_expected:
+            raise Exception('checksums do not match {} != {}'.format(sha256.hexdigest(), sha256_expected))
 
-        content = gzip.GzipFile(fileobj=io.BytesIO(primary.content))
-        os.lseek(f.fileno(), 0, os.SEEK_SET)
-        f.write(content.read())
-        f.flush()
-        os.lseek(f.fileno(), 0, os.SEEK_SET)
-        repo.add_rpmmd(solv.xfopen_fd(None, f.fileno()), None, 0)
+        # libsolv decompresses based on the file name while reading
+        repo.add_rpmmd(solv.xfopen_fd(location, f.fileno()), None, 0)
         return True
 
-    return False
-
 def parse_susetags(repo, baseurl):
     url = urljoin(baseurl, 'content')
     content = requests.get(url)
     if content.status_code != requests.codes.ok:
         return False
 
-    f = tempfile.TemporaryFile()
-    f.write(content.content)
-    f.flush()
-    os.lseek(f.fileno(), 0, os.SEEK_SET)
-    repo.add_content(solv.xfopen_fd(None, f.fileno()), 0)
+    with tempfile.TemporaryFile() as f:
+        f.write(content.content)
+        f.flush()
+        os.lseek(f.fileno(), 0, os.SEEK_SET)
+        repo.add_content(solv.xfopen_fd(None, f.fileno()), 0)
 
     defvendorid = repo.meta.lookup_id(solv.SUSETAGS_DEFAULTVENDOR)
     descrdir = repo.meta.lookup_str(solv.SUSETAGS_DESCRDIR)
@@ -120,24 +152,28 @@ def parse_susetags(repo, baseurl):
         descrdir = 'suse/setup/descr'
 
     url = urljoin(baseurl, descrdir + '/packages.gz')
-    with requests.get(url, stream=True) as packages:
-        if packages.status_code != requests.codes.ok:
+    with tempfile.TemporaryFile() as f:
+        if not download(url, f):
             raise Exception(url + ' does not exist')
 
-        content = gzip.GzipFile(fileobj=io.BytesIO(packages.content))
-        os.lseek(f.fileno(), 0, os.SEEK_SET)
-        f.write(content.read())
-        f.flush()
-        os.lseek(f.fileno(), 0, os.SEEK_SET)
         try:
-            repo.add_susetags(f, defvendorid, None, solv.Repo.REPO_NO_INTERNALIZE | solv.Repo.SUSETAGS_RECORD_SHARES)
+            repo.add_susetags(solv.xfopen_fd('packages.gz', f.fileno()), defvendorid, None,
+                              solv.Repo.REPO_NO_INTERNALIZE | solv.Repo.SUSETAGS_RECORD_SHARES)
         except TypeError:
             logger.error(f"Failed to add susetags for {url}")
             return False
         return True
-    return False
 
 def dump_solv(name, baseurl):
+    cache_file = os.path.join(SOLV_CACHE, hashlib.sha256(baseurl.encode('utf-8')).hexdigest())
+    fingerprint = repo_fingerprint(baseurl)
+    if fingerprint and os.path.exists(cache_file + '.solv') and os.path.exists(cache_file + '.checksum'):
+        with open(cache_file + '.checksum') as f:
+            if f.read() == fingerprint:
+                logger.info('%s unchanged, using cached solv', baseurl)
+                shutil.copyfile(cache_file + '.solv', name)
+                return name
+
     pool = solv.Pool()
     pool.setarch()
 
@@ -150,21 +186,23 @@ def dump_solv(name, baseurl):
     ofh = solv.xfopen(name, 'w')
     repo.write(ofh)
     ofh.flush()
+    ofh.close()
+
+    if fingerprint:
+        shutil.copyfile(name, cache_file + '.solv.tmp')
+        os.rename(cache_file + '.solv.tmp', cache_file + '.solv')
+        with open(cache_file + '.checksum', 'w') as f:
+            f.write(fingerprint)
 
     return name
 
-def print_repo_delta(pool, repo2, packages_file):
+def print_repo_delta(present, repo2, packages_file):
+    """Print the packages of repo2 whose name/arch and evr are not present."""
     print('=Ver: 2.0', file=packages_file)
-    present = dict()
-    for s in pool.solvables_iter():
-        if s.repo != repo2:
-            key = '{}/{}'.format(s.name, s.arch)
-            present.setdefault(key, {})
-            present[key][s.evr] = s.repo
     for s in repo2.solvables:
         if s.arch == 'src': continue
         key = '{}/{}'.format(s.name, s.arch)
-        if present.get(key, {}).get(s.evr):
+        if s.evr in present.get(key, ()):
             continue
         elif not key in present:
             print('# NEW', s.name, s.arch, file=packages_file)
@@ -176,11 +214,114 @@ def print_repo_delta(pool, repo2, packages_file):
             print(dep, file=packages_file)
         print('-Prv:', file=packages_file)
 
+def packages_known(filename):
+    """Yield name/arch and evr of every package in a packages.xz delta."""
+    with lzma.open(filename, 'rt') as f:
+        for line in f:
+            if not line.startswith('=Pkg: '):
+                continue
+            _, name, version, release, arch = line.rstrip('\n').split(' ')
+            evr = '{}-{}'.format(version, release) if version else release
+            yield '{}/{}'.format(name, arch), evr
+
+class KnownIndex(object):
+    """
+    Persisted name/arch -> evrs of all deltas uploaded for a key.
+
+    Only history files not yet part of the index are read, instead of
+    parsing all of the history for every new build.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = set()
+        self.known = dict()
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.files = set(data['files'])
+            self.known = {key: set(evrs) for key, evrs in data['known'].items()}
+
+    def update(self, filenames):
+        names = {os.path.basename(fn): fn for fn in filenames}
+        if not self.files <= set(names):
+            # history was rewritten, start over
+            self.files = set()
+            self.known = dict()
+        for name in sorted(set(names) - self.files):
+            for key, evr in packages_known(names[name]):
+                self.known.setdefault(key, set()).add(evr)
+            self.files.add(name)
+
+    def add(self, filename, repo):
+        for s in repo.solvables:
+            if s.arch == 'src': continue
+            self.known.setdefault('{}/{}'.format(s.name, s.arch), set()).add(s.evr)
+        self.files.add(os.path.basename(filename))
+
+    def save(self):
+        data = {
+            'files': sorted(self.files),
+            'known': {key: sorted(evrs) for key, evrs in self.known.items()},
+        }
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.rename(self.path + '.tmp', self.path)
+
+def update_repo(apiurl, project, repo_dir, index_dir, key, opts):
+    if not opts['url'].endswith('/'):
+        opts['url'] += '/'
+
+    if opts.get('refresh', False):
+        opts['build'] = dump_solv_build(opts['url'])
+        path = '{}_{}.packages'.format(key, opts['build'])
+    else:
+        path = key + '.packages'
+    packages_file = os.path.join(repo_dir, path)
+
+    if os.path.exists(packages_file + '.xz'):
+        print(path, 'already exists')
+        return True
+
+    solv_file = packages_file + '.solv'
+    dump_solv(solv_file, opts['url'])
+
+    index = None
+    present = dict()
+    if opts.get('refresh', False):
+        index = KnownIndex(os.path.join(index_dir, key + '.json'))
+        index.update(glob.glob(os.path.join(repo_dir, '{}_*.packages.xz'.format(key))))
+        present = index.known
+
+    pool = solv.Pool()
+    pool.setarch()
+    repo1 = pool.add_repo(''.join(random.choice(string.ascii_letters) for _ in range(5)))
+    repo1.add_solv(solv_file)
+
+    with lzma.open(packages_file + '.xz', 'wt', preset=9) as f:
+        print_repo_delta(present, repo1, f)
+    os.unlink(solv_file)
+
+    url = osc.core.makeurl(apiurl, ['source', project, '000update-repos', path + '.xz'])
+    try:
+        osc.core.http_PUT(url, data=open(packages_file + '.xz', 'rb').read())
+    except HTTPError:
+        logger.error(f"Failed to upload to {url}")
+        return False
+
+    if index:
+        index.add(packages_file + '.xz', repo1)
+        index.save()
+
+    del pool
+    return True
+
 def update_project(apiurl, project):
     # Cache dir specific to hostname and project.
     host = urlparse(apiurl).hostname
     cache_dir = CacheManager.directory('update_repo_handler', host, project)
     repo_dir = os.path.join(cache_dir, '000update-repos')
+    index_dir = CacheManager.directory('update_repo_handler-index', host, project)
 
     # development aid
     checkout = True
@@ -192,53 +333,16 @@ def update_project(apiurl, project):
         osc.core.checkout_package(apiurl, project, '000update-repos', expand_link=True, prj_dir=cache_dir)
 
     root = yaml.safe_load(open(os.path.join(repo_dir, 'config.yml')))
+    repos = []
     for item in root:
         key = list(item)[0]
-        opts = item[key]
         # cast 15.1 to string :)
-        key = str(key)
-        if not opts['url'].endswith('/'):
-            opts['url'] += '/'
-
-        if opts.get('refresh', False):
-            opts['build'] = dump_solv_build(opts['url'])
-            path = '{}_{}.packages'.format(key, opts['build'])
-        else:
-            path = key + '.packages'
-        packages_file = os.path.join(repo_dir, path)
-
-        if os.path.exists(packages_file + '.xz'):
-            print(path, 'already exists')
-            continue
-
-        solv_file = packages_file + '.solv'
-        dump_solv(solv_file, opts['url'])
-
-        pool = solv.Pool()
-        pool.setarch()
-
-        if opts.get('refresh', False):
-            for file in glob.glob(os.path.join(repo_dir, '{}_*.packages.xz'.format(key))):
-                repo = pool.add_repo(file)
-                defvendorid = repo.meta.lookup_id(solv.SUSETAGS_DEFAULTVENDOR)
-                f = tempfile.TemporaryFile()
-                # FIXME: port to lzma module with python3
-                st = subprocess.call(['xz', '-cd', file], stdout=f.fileno())
-                os.lseek(f.fileno(), 0, os.SEEK_SET)
-                repo.add_susetags(solv.xfopen_fd(None, f.fileno()), defvendorid, None, solv.Repo.REPO_NO_INTERNALIZE | solv.Repo.SUSETAGS_RECORD_SHARES)
+        repos.append((str(key), item[key]))
 
-        repo1 = pool.add_repo(''.join(random.choice(string.ascii_letters) for _ in range(5)))
-        repo1.add_solv(solv_file)
-
-        print_repo_delta(pool, repo1, open(packages_file, 'w'))
-        subprocess.call(['xz', '-9', packages_file])
-        os.unlink(solv_file)
-
-        url = osc.core.makeurl(apiurl, ['source', project, '000update-repos', path + '.xz'])
-        try:
-            osc.core.http_PUT(url, data=open(packages_file + '.xz', 'rb').read())
-        except HTTPError:
-            logger.error(f"Failed to upload to {url}")
-            sys.exit(1)
+    # keys are independent of each other
+    with ThreadPoolExecutor(max_workers=UPDATE_WORKERS) as executor:
+        results = list(executor.map(
+            lambda r: update_repo(apiurl, project, repo_dir, index_dir, *r), repos))
 
-        del pool
+    if not all(results):
+        sys.exit(1)
@@ -1,32 +1,43 @@
 #!/usr/bin/python3
 
 import argparse
+import json
 import logging
 import os
 import re
 import sys
 
+from concurrent.futures import ThreadPoolExecutor
 from xml.etree import cElementTree as ET
 from urllib.error import HTTPError
+from urllib.parse import quote_plus
+from urllib.parse import urlparse
 
 import osc.conf
 import osc.core
 
+from osclib.cache_manager import CacheManager
 from osclib.conf import Config
 
 OPENSUSE = 'openSUSE:Factory'
 PACKAGEFILE = 'packagelist_without_32bitRPMs_imported'
 
+# number of concurrent source listings fetched in bulk mode
+LISTING_WORKERS = 8
+# number of packages to wipe per request
+WIPE_CHUNK = 50
+
 makeurl = osc.core.makeurl
 http_GET = osc.core.http_GET
 http_POST = osc.core.http_POST
 
 class ScanBaselibs(object):
-    def __init__(self, project, repository, verbose, wipebinaries):
+    def __init__(self, project, repository, verbose, wipebinaries, bulk=False):
         self.project = project
         self.verbose = verbose
         self.repo = repository
         self.wipebinaries = wipebinaries
+        self.bulk = bulk
         self.apiurl = osc.conf.config['apiurl']
         self.debug = osc.conf.config['debug']
         Config(self.apiurl, OPENSUSE)
@@ -65,6 +76,89 @@ class ScanBaselibs(object):
                 return True
         return False
 
+    def _baselibs_cache_path(self, project):
+        host = urlparse(self.apiurl).hostname
+        return os.path.join(CacheManager.directory('scan_baselibs', host), project + '.json')
+
+    def packages_with_baselibs(self, project, packages):
+        """
+        Return the packages that have a baselibs.conf.
+
+        The result per srcmd5 of the expanded sources, all loaded with a single
+        view=info request, is cached across runs so only changed packages
+        need their source listing fetched.
+        """
+        query = {'view': 'info', 'nofilename': 1}
+        root = ET.parse(http_GET(makeurl(self.apiurl, ['source', project], query=query))).getroot()
+        srcmd5s = {}
+        for si in root.findall('sourceinfo'):
+            if si.get('srcmd5'):
+                srcmd5s[si.get('package')] = si.get('srcmd5')
+
+        path = self._baselibs_cache_path(project)
+        try:
+            with open(path) as f:
+                cache = json.load(f)
+        except (IOError, ValueError):
+            cache = {}
+
+        found = {pkg: cache[srcmd5s[pkg]] for pkg in packages if srcmd5s.get(pkg) in cache}
+        todo = [pkg for pkg in packages if pkg not in found]
+        if self.verbose:
+            print('Fetching the source listing of %d of %d packages' % (len(todo), len(packages)))
+        with ThreadPoolExecutor(max_workers=LISTING_WORKERS) as executor:
+            found.update(zip(todo, executor.map(
+                lambda pkg: self.package_has_baselibs(project, pkg), todo)))
+
+        # Only keep entries of the current sources, packages without
+        # sourceinfo (eg. inherited via project link) are not cached.
+        cache = {srcmd5s[pkg]: found[pkg] for pkg in packages if pkg in srcmd5s}
+        with open(path + '.tmp', 'w') as f:
+            json.dump(cache, f)
+        os.rename(path + '.tmp', path)
+
+        result = [pkg for pkg in packages if found[pkg]]
+        return result
+
+    def packages_with_32bit_binaries(self, project, repo):
+        """Return the packages that imported 32bit binaries from a single binarylist."""
+        query = { 'repository': repo,
+                  'arch': 'x86_64',
+                  'multibuild': 1,
+                  'view': 'binarylist' }
+        root = ET.parse(http_GET(makeurl(self.apiurl, ['build', project, '_result'], query = query))).getroot()
+        packages = set()
+        for binarylist in root.findall('./result/binarylist'):
+            for i in binarylist.findall('binary'):
+                if i.get('filename').startswith('::import::i586::'):
+                    # assume 32bit importing RPMs can be appeared in multibuild-ed package
+                    packages.add(binarylist.get('package').split(':')[0])
+                    break
+        return packages
+
+    def check_package_baselibs_bulk(self, project, repo, wipebinaries):
+        """Main method, evaluating all packages from project wide documents"""
+        if self.verbose:
+            print('Gathering the package list from %s' % project)
+        packages = [pkg for pkg in self.get_packages(project) if pkg not in self.package_whitelist]
+
+        imported = self.packages_with_32bit_binaries(project, repo)
+        # Listings are only needed for packages without imported binaries.
+        candidates = [pkg for pkg in packages if pkg not in imported]
+        missing = self.packages_with_baselibs(project, candidates)
+
+        with open(os.getcwd() + '/' + PACKAGEFILE, "a") as f:
+            for pkg in missing:
+                f.write("%s\n" % pkg)
+                if self.verbose:
+                    print('%s has baselibs.conf but 32bit RPMs does not exist on 64bit\'s build result.' % pkg)
+
+        if wipebinaries:
+            for i in range(0, len(missing), WIPE_CHUNK):
+                query = ['cmd=wipe', 'repository=%s' % quote_plus(repo), 'arch=i586']
+                query += ['package=%s' % quote_plus(pkg) for pkg in missing[i:i + WIPE_CHUNK]]
+                http_POST(makeurl(self.apiurl, ['build', project], query))
+
     def check_package_baselibs(self, project, repo, wipebinaries):
         """Main method"""
         # get souce packages from target
@@ -99,7 +193,10 @@ class ScanBaselibs(object):
         print('Scanning...')
         if os.path.isfile(os.getcwd() + '/' + PACKAGEFILE):
             os.remove(os.getcwd() + '/' + PACKAGEFILE)
-        self.check_package_baselibs(self.project, self.repo, self.wipebinaries)
+        if self.bulk:
+            self.check_package_baselibs_bulk(self.project, self.repo, self.wipebinaries)
+        else:
+            self.check_package_baselibs(self.project, self.repo, self.wipebinaries)
         print('Done')
 
 def main(args):
@@ -107,7 +204,7 @@ def main(args):
     osc.conf.get_config(override_apiurl=args.apiurl)
     osc.conf.config['debug'] = args.debug
 
-    uc = ScanBaselibs(args.project, args.repository, args.verbose, args.wipebinaries)
+    uc = ScanBaselibs(args.project, args.repository, args.verbose, args.wipebinaries, args.bulk)
     uc.scan()
 
 if __name__ == '__main__':
@@ -128,6 +225,8 @@ if __name__ == '__main__':
                         help='show the verbose information')
     parser.add_argument('-w', '--wipebinaries', action='store_true', default=False,
                         help='wipe binaries found without imported 32bit RPMs')
+    parser.add_argument('-b', '--bulk', action='store_true', default=False,
+                        help='scan the whole project using a single build result and cached source listings')
 
     args = parser.parse_args()
 
@@ -35,6 +35,8 @@ PROJECT = 'openSUSE:Factory'
 
 OSCRC = '/tmp/.oscrc-test'
 OSCCOOKIEJAR = '/tmp/.osc_cookiejar-test'
+# the real patterns, StagingWorkflow disables them
+CACHE_PATTERNS = Cache.PATTERNS
 
 class TestCase(unittest.TestCase):
     script = None
@@ -204,6 +206,12 @@ class StagingWorkflow(object):
         self.load_config()
         self.api = StagingAPI(APIURL, project)
 
+    def enable_cache(self):
+        """Cache requests with the real patterns like the tools do."""
+        Cache.CACHE_DIR = None
+        Cache.PATTERNS = CACHE_PATTERNS
+        Cache.init()
+
     def load_config(self, project=None):
         if project is None:
             project = self.project
@@ -189,6 +189,10 @@ Pico text editor while also offering a few enhancements.</description>
                                match_querystring=True,
                                body=self._request_withhistory)
 
+        httpretty.register_uri(httpretty.GET,
+                               APIURL + "/search/request?match=%40id%3D%27293129%27&withfullhistory=1",
+                               match_querystring=True,
+                               body='<collection matches="1">' + self._request_data + '</collection>')
         httpretty.register_uri(httpretty.GET,
                                APIURL + '/search/request',
                                body='<collection matches="0"></collection>')
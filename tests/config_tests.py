@@ -1,7 +1,9 @@
+import os
 import unittest
 from osc import conf
 from osclib.conf import DEFAULT
 from osclib.conf import Config
+from osclib.core import attribute_value_load
 from osclib.core import attribute_value_save
 from osclib.memoize import memoize_session_reset
 from osclib.stagingapi import StagingAPI
@@ -73,3 +75,20 @@ class TestConfig(unittest.TestCase):
         memoize_session_reset()
 
         self.assertEqual('new value', Config.get(wf.apiurl, wf.project)['remote-only'])
+
+    def test_remote_cached(self):
+        """Ensure the remote config loads with the request cache enabled."""
+        wf = self.setup_vcr()
+        wf.enable_cache()
+        self.assertIn('remote-only = remote-indeed', attribute_value_load(wf.apiurl, wf.project, 'Config'))
+
+        Config.remote_cache_delete(wf.apiurl, wf.project)
+        wf.load_config()
+        self.assertEqual('remote-indeed', conf.config[wf.project]['remote-only'])
+
+        # Expired local copy is revalidated by the ETag of the attribute.
+        path = Config.remote_cache_path(wf.apiurl, wf.project)
+        os.utime(path, (0, 0))
+        wf.load_config()
+        self.assertEqual('remote-indeed', conf.config[wf.project]['remote-only'])
+        self.assertGreater(os.path.getmtime(path), 0)
@@ -0,0 +1,61 @@
+import io
+import unittest
+
+from osclib.cpio import Cpio
+
+
+def member(name, data):
+    name = name.encode('utf-8') + b'\0'
+    header = b'070701' + b''.join(b'%08X' % v for v in (
+        0, 0o100644, 0, 0, 1, 0, len(data), 0, 0, 0, 0, len(name), 0))
+    out = header + name
+    out += b'\0' * ((4 - len(out) % 4) % 4)
+    out += data
+    out += b'\0' * ((4 - len(data) % 4) % 4)
+    return out
+
+
+def archive(members):
+    return b''.join(member(n, d) for n, d in members) + member('TRAILER!!!', b'')
+
+
+class NonSeekable(io.RawIOBase):
+    def __init__(self, data):
+        self.fh = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self.fh.read(size)
+
+
+class TestCpio(unittest.TestCase):
+    members = [('a', b'12345'), ('bb', b''), ('ccc', b'x' * 70000)]
+
+    def test_buffer(self):
+        buf = archive(self.members)
+        result = [(f.name, f.payload()) for f in Cpio(buf)]
+        self.assertEqual([n for n, _ in self.members], [n for n, _ in result])
+        self.assertEqual(self.members[0][1], result[0][1].tobytes())
+        self.assertIsInstance(result[2][1], memoryview)
+        self.assertEqual(self.members[2][1], bytes(result[2][1]))
+
+    def test_stream(self):
+        for fh in (io.BytesIO(archive(self.members)), NonSeekable(archive(self.members))):
+            result = []
+            for f in Cpio(fh):
+                # only read the first bytes, the rest has to be skipped
+                result.append((f.name, f.read(3)))
+            self.assertEqual([(n, d[:3]) for n, d in self.members], result)
+
+    def test_read_bounded(self):
+        for f in Cpio(io.BytesIO(archive(self.members))):
+            self.assertEqual(dict(self.members)[f.name], f.read(1000000))
+            self.assertEqual(b'', f.read())
+
+    def test_invalid(self):
+        with self.assertRaises(Exception):
+            list(Cpio(b'070702' + b'0' * 200))
+        with self.assertRaises(Exception):
+            list(Cpio(archive(self.members)[:50]))
@@ -49,9 +49,7 @@ class TestFactorySourceAccept(unittest.TestCase):
             APIURL + '/source/openSUSE:Factory/00Meta/lookup.yml',
             status = 404)
 
-        httpretty.register_uri(httpretty.GET,
-            APIURL + "/request/770001",
-            body = """
+        request = """
                 <request id="770001" creator="chameleon">
                   <action type="submit">
                     <source project="Base:System" package="timezone" rev="481ecbe0dfc63ece3a1f1b5598f7d96c"/>
@@ -63,7 +61,17 @@ class TestFactorySourceAccept(unittest.TestCase):
                   <review state="new" by_user="factory-source"/>
                   <description>...</description>
                 </request>
-            """)
+            """
+
+        httpretty.register_uri(httpretty.GET,
+            APIURL + "/request/770001",
+            body = request)
+
+        # registered before the catch-all search below
+        httpretty.register_uri(httpretty.GET,
+            APIURL + "/search/request?match=%40id%3D%27770001%27&withfullhistory=1",
+            match_querystring = True,
+            body = '<collection matches="1">' + request + '</collection>')
 
         httpretty.register_uri(httpretty.GET,
             APIURL + "/source/Base:System/timezone?view=info&rev=481ecbe0dfc63ece3a1f1b5598f7d96c",
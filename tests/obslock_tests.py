@@ -1,5 +1,10 @@
 from datetime import datetime
+import threading
+import time
 import unittest
+from mock import patch
+import osc.core
+from urllib.error import HTTPError
 from osclib.conf import Config
 from osclib.obslock import OBSLock
 from . import OBSLocal
@@ -155,3 +160,84 @@ class TestOBSLock(unittest.TestCase):
                 lock2.release(force=True)
                 user, _, _, _ = lock2._parse(lock2._read())
                 self.assertEqual(user, None, 'unlocked')
+
+    def test_wait_timeout(self):
+        wf = self.setup_vcr()
+        lock1 = self.obs_lock(wf)
+        lock2 = self.obs_lock(wf)
+        lock2.user = 'user2'
+        lock2.wait = 3
+
+        with lock1:
+            start = time.time()
+            self.assertLockFail(lock2)
+            self.assertGreaterEqual(time.time() - start, 3)
+
+    def test_wait_released(self):
+        wf = self.setup_vcr()
+        lock1 = self.obs_lock(wf)
+        lock2 = self.obs_lock(wf)
+        lock2.user = 'user2'
+        lock2.wait = 60
+
+        lock1.acquire()
+        timer = threading.Timer(3, lock1.release)
+        timer.start()
+        try:
+            with lock2:
+                self.assertTrue(lock2.locked)
+                self.assertFalse(lock1.locked)
+        finally:
+            timer.join()
+
+    def test_read_not_modified(self):
+        wf = self.setup_vcr()
+        lock = self.obs_lock(wf)
+
+        with lock:
+            signature = lock._read()
+            # independent of whether the server sends an ETag
+            lock.read_etag = '"etag"'
+            not_modified = HTTPError('url', 304, 'Not Modified', {}, None)
+            with patch.object(osc.core, '_http_request', side_effect=not_modified) as http_request:
+                self.assertEqual(signature, lock._read(conditional=True))
+                self.assertEqual({'If-None-Match': '"etag"'}, http_request.call_args[0][2])
+
+    def test_cached(self):
+        wf = self.setup_vcr()
+        wf.enable_cache()
+        lock = self.obs_lock(wf)
+
+        with lock:
+            self.assertTrue(lock.locked)
+            user, reason, _, _ = lock._parse(lock._read())
+            self.assertEqual(user, lock.user)
+            self.assertEqual(reason, 'list')
+
+        self.assertFalse(lock.locked)
+        user, _, _, _ = lock._parse(lock._read())
+        self.assertIsNone(user)
+
+    def test_lease_lost(self):
+        wf = self.setup_vcr()
+        lock1 = self.obs_lock(wf)
+        lock1.ttl = 3
+        lock1.lease = True
+        lock2 = self.obs_lock(wf)
+        lock2.user = 'user2'
+
+        with lock1:
+            signature = lock1._read()
+            # renewed every ttl / 3
+            time.sleep(1.5)
+            self.assertNotEqual(signature, lock1._read())
+
+            # taken over, eg. forcefully, the lease must not overwrite it
+            lock2._write(lock2._signature())
+            time.sleep(2)
+            user, _, _, _ = lock1._parse(lock1._read())
+            self.assertEqual(user, lock2.user)
+
+        user, _, _, _ = lock1._parse(lock1._read())
+        self.assertEqual(user, lock2.user, 'lock of another user is not released')
+        lock2.release(force=True)
@@ -0,0 +1,75 @@
+from osclib.openqa_jobs import OpenQAJobs
+import unittest
+
+
+def job(id, build, test='textmode'):
+    return {
+        'id': id,
+        'settings': {
+            'DISTRI': 'opensuse',
+            'BUILD': build,
+            'TEST': test,
+        },
+    }
+
+
+class FakeClient(object):
+    def __init__(self, jobs):
+        self.all_jobs = jobs
+        self.requests = []
+
+    def openqa_request(self, method, path, params):
+        # openQA only honors a single value per parameter
+        self.requests.append(dict(params))
+        return {'jobs': [j for j in self.all_jobs if j['settings']['BUILD'] == params['build']]}
+
+
+class TestOpenQAJobs(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient([
+            job(1, '1.1'),
+            job(2, '1.2'),
+            job(3, '1.2', test='gnome'),
+        ])
+        self.view = OpenQAJobs(self.client)
+        self.query = {'distri': 'opensuse', 'latest': '1'}
+
+    def jobs(self, build):
+        return [j['id'] for j in self.view.jobs(dict(self.query, build=build))]
+
+    def test_cached(self):
+        self.assertEqual([1], self.jobs('1.1'))
+        self.assertEqual([2, 3], self.jobs('1.2'))
+        self.assertEqual([1], self.jobs('1.1'))
+        self.assertEqual(2, len(self.client.requests))
+        self.assertEqual('1', self.client.requests[0]['latest'])
+
+    def test_invalidate(self):
+        self.jobs('1.1')
+        self.jobs('1.2')
+        self.view.invalidate({'BUILD': '1.2', 'TEST': 'gnome'})
+        self.jobs('1.1')
+        self.assertEqual(2, len(self.client.requests))
+        self.jobs('1.2')
+        self.assertEqual(3, len(self.client.requests))
+
+        self.view.invalidate()
+        self.jobs('1.1')
+        self.assertEqual(4, len(self.client.requests))
+
+    def test_ttl(self):
+        self.view.ttl = 0
+        self.jobs('1.1')
+        self.view.cache[self.view._key(dict(self.query, build='1.1'))] = (0, [])
+        self.assertEqual([1], self.jobs('1.1'))
+        self.assertEqual(2, len(self.client.requests))
+
+    def test_max_entries(self):
+        self.view.max_entries = 1
+        self.jobs('1.1')
+        self.jobs('1.2')
+        self.assertEqual(1, len(self.view.cache))
+        self.jobs('1.2')
+        self.assertEqual(2, len(self.client.requests))
+        self.jobs('1.1')
+        self.assertEqual(3, len(self.client.requests))
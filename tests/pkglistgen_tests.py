@@ -0,0 +1,59 @@
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+import solv
+
+from pkglistgen.solv_store import SolvStore
+from pkglistgen.tool import PkgListGen
+
+
+class TestNamespaceSupplements(unittest.TestCase):
+    def add(self, repo, name, supplements=None):
+        s = repo.add_solvable()
+        s.name = name
+        s.evr = '1-1'
+        s.arch = 'x86_64'
+        if supplements:
+            s.add_deparray(solv.SOLVABLE_SUPPLEMENTS, supplements)
+
+    def test_supplements(self):
+        pool = solv.Pool()
+        pool.setarch('x86_64')
+        repo = pool.add_repo('test')
+        self.add(repo, 'driver', pool.Dep('namespace:modalias(pci:v00008086d*)'))
+        self.add(repo, 'btrfsprogs', pool.parserpmrichdep('(kernel and namespace:filesystem(btrfs))'))
+        self.add(repo, 'lang', pool.parserpmrichdep('(bash and lang-base)'))
+        self.add(repo, 'plain')
+        repo.internalize()
+        pool.createwhatprovides()
+
+        self.assertEqual({'driver', 'btrfsprogs'}, PkgListGen._namespace_supplements(pool))
+
+
+class TestSolvStore(unittest.TestCase):
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.store = SolvStore(self.cachedir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    @patch('pkglistgen.solv_store.repository_arch_state', return_value='abc')
+    def test_state_fetched_once(self, repository_arch_state):
+        solv_file = self.store.solv_file('openSUSE:Factory', 'standard', 'x86_64')
+        open(solv_file, 'a').close()
+        open(solv_file + '::abc', 'a').close()
+
+        self.assertEqual('abc', self.store.remote_state('http://api', 'openSUSE:Factory', 'standard', 'x86_64'))
+        self.assertFalse(self.store.update_repo('http://api', 'openSUSE:Factory', 'standard', 'x86_64'))
+        self.assertFalse(self.store.update_repo('http://api', 'openSUSE:Factory', 'standard', 'x86_64'))
+        self.assertEqual('abc', self.store.state('openSUSE:Factory', 'standard', 'x86_64'))
+        self.assertEqual(1, repository_arch_state.call_count)
+
+    @patch('pkglistgen.solv_store.repository_arch_state', return_value=None)
+    def test_missing(self, repository_arch_state):
+        self.assertIsNone(self.store.update_repo('http://api', 'openSUSE:Factory', 'ports', 'x86_64'))
+        self.assertIsNone(self.store.remote_state('http://api', 'openSUSE:Factory', 'ports', 'x86_64'))
+        self.assertEqual(1, repository_arch_state.call_count)
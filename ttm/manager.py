@@ -48,6 +48,8 @@ class ToTestManager(ToolBase.ToolBase):
     def setup(self, project):
         self.project = ToTest(project, self.apiurl)
         self.api = StagingAPI(self.apiurl, project=project)
+        # binary listings only change between runs, so keep them for this one
+        self._binaries = {}
 
     def version_file(self, target):
         return 'version_%s' % target
@@ -76,11 +78,23 @@ class ToTestManager(ToolBase.ToolBase):
                                       arch=self.project.image_products[0].archs[0])
 
     def binaries_of_product(self, project, product, repo=None, arch=None):
+        return [filename for filename, _ in self.binary_list(project, product, repo=repo, arch=arch)]
+
+    def binary_list(self, project, product, repo=None, arch=None):
+        """Return the (filename, size) tuples of the product's binaries
+
+        The listing is cached for the rest of the run as several checks look
+        at the same product.
+        """
         if repo is None:
             repo = self.project.product_repo
         if arch is None:
             arch = self.project.product_arch
 
+        key = (project, repo, arch, product)
+        if key in self._binaries:
+            return self._binaries[key]
+
         url = self.api.makeurl(['build', project, repo, arch, product])
         try:
             f = self.api.retried_GET(url)
@@ -90,8 +104,9 @@ class ToTestManager(ToolBase.ToolBase):
         ret = []
         root = ET.parse(f).getroot()
         for binary in root.findall('binary'):
-            ret.append(binary.get('filename'))
+            ret.append((binary.get('filename'), int(binary.get('size', 0))))
 
+        self._binaries[key] = ret
         return ret
 
     def ftp_build_version(self, project, tree):
@@ -10,7 +10,9 @@
 # Distribute under GPLv2 or GPLv3
 
 
+from concurrent.futures import ThreadPoolExecutor
 import json
+import os
 import re
 import yaml
 import pika
@@ -18,9 +20,17 @@ import time
 
 import osc
 from osc.core import makeurl
+from osclib.cache_manager import CacheManager
 from ttm.manager import ToTestManager, NotFoundException, QAResult
 from openqa_client.client import OpenQA_Client
 
+# Comments on finished jobs rarely change, but humans still add bug
+# references to failed jobs, so cached comments are refreshed after a while.
+JOB_COMMENTS_TTL = 60 * 60
+JOB_COMMENTS_WORKERS = 8
+
+FAILED_RESULTS = ('failed', 'incomplete', 'timeout_exceeded', 'skipped', 'user_cancelled', 'obsoleted', 'parallel_failed')
+
 class ToTestPublisher(ToTestManager):
 
     def __init__(self, tool):
@@ -46,15 +56,14 @@ class ToTestPublisher(ToTestManager):
             self.logger.warning('we have only %s jobs' % len(jobs))
             return QAResult.inprogress
 
+        job_comments = self.load_job_comments([job for job in jobs if job['result'] in FAILED_RESULTS])
+
         in_progress = False
         for job in jobs:
             # print json.dumps(job, sort_keys=True, indent=4)
-            if job['result'] in ('failed', 'incomplete', 'timeout_exceeded', 'skipped', 'user_cancelled', 'obsoleted', 'parallel_failed'):
+            if job['result'] in FAILED_RESULTS:
                 # print json.dumps(job, sort_keys=True, indent=4), jobname
-                url = makeurl(self.project.openqa_server,
-                              ['api', 'v1', 'jobs', str(job['id']), 'comments'])
-                f = self.api.retried_GET(url)
-                comments = json.load(f)
+                comments = job_comments[job['id']]
                 refs = set()
                 labeled = 0
                 to_ignore = False
@@ -89,6 +98,7 @@ class ToTestPublisher(ToTestManager):
                         else:
                             self.openqa.openqa_request(
                                 'PUT', 'jobs/%s/comments/%d' % (job['id'], labeled), data=data)
+                            self.job_comments_cache.pop(job['id'], None)
 
                     self.logger.info('job %s failed, but was ignored', job['name'])
                 else:
@@ -100,6 +110,7 @@ class ToTestPublisher(ToTestManager):
                         else:
                             self.openqa.openqa_request(
                                 'POST', 'jobs/%s/comments' % job['id'], data=data)
+                            self.job_comments_cache.pop(job['id'], None)
 
                     joburl = '%s/tests/%s' % (self.project.openqa_server, job['id'])
                     self.logger.info('job %s failed, see %s', job['name'], joburl)
@@ -113,6 +124,7 @@ class ToTestPublisher(ToTestManager):
                 raise Exception(job['result'])
 
         self.save_issues_to_ignore()
+        self.save_job_comments_cache()
 
         if len(self.failed_relevant_jobs) > 0:
             return QAResult.failed
@@ -122,6 +134,54 @@ class ToTestPublisher(ToTestManager):
 
         return QAResult.passed
 
+    def job_comments_cache_path(self):
+        return os.path.join(CacheManager.directory('ttm'), 'job-comments-{}.json'.format(self.project.name))
+
+    def load_job_comments(self, jobs):
+        """Return the comments of the given jobs keyed by job id
+
+        Comments are cached across runs for JOB_COMMENTS_TTL seconds and the
+        missing ones are fetched concurrently.
+        """
+
+        try:
+            with open(self.job_comments_cache_path(), 'r') as f:
+                cached = {int(job_id): entry for job_id, entry in json.load(f).items()}
+        except (IOError, ValueError):
+            cached = {}
+
+        now = time.time()
+        # only keep the jobs of the current snapshot to bound the cache
+        self.job_comments_cache = {}
+        for job in jobs:
+            entry = cached.get(job['id'])
+            if entry and entry['t_finished'] == job.get('t_finished') and now - entry['fetched'] < JOB_COMMENTS_TTL:
+                self.job_comments_cache[job['id']] = entry
+
+        missing = [job for job in jobs if job['id'] not in self.job_comments_cache]
+        if len(missing):
+            self.logger.debug('fetching comments of %d jobs', len(missing))
+            with ThreadPoolExecutor(max_workers=JOB_COMMENTS_WORKERS) as executor:
+                fetched = executor.map(self.fetch_job_comments, [job['id'] for job in missing])
+                for job, comments in zip(missing, fetched):
+                    self.job_comments_cache[job['id']] = {
+                        't_finished': job.get('t_finished'),
+                        'fetched': now,
+                        'comments': comments,
+                    }
+
+        return {job_id: entry['comments'] for job_id, entry in self.job_comments_cache.items()}
+
+    def fetch_job_comments(self, job_id):
+        url = makeurl(self.project.openqa_server,
+                      ['api', 'v1', 'jobs', str(job_id), 'comments'])
+        f = self.api.retried_GET(url)
+        return json.load(f)
+
+    def save_job_comments_cache(self):
+        with open(self.job_comments_cache_path(), 'w') as f:
+            json.dump(self.job_comments_cache, f)
+
     def send_amqp_event(self, current_snapshot, current_result):
         amqp_url = osc.conf.config.get('ttm_amqp_url')
         if not amqp_url:
@@ -9,6 +9,7 @@
 # Distribute under GPLv2 or GPLv3
 
 import re
+from urllib.parse import quote_plus
 from xml.etree import cElementTree as ET
 
 from ttm.manager import ToTestManager, NotFoundException, QAResult
@@ -95,25 +96,48 @@ class ToTestReleaser(ToTestManager):
         # Other types don't have a fixed size limit
         return None
 
-    def package_ok(self, project, package, repository, arch):
-        """Checks one package in a project and returns True if it's succeeded
+    def build_results(self, project, repository, packages, archs):
+        """Fetch the build results of several packages in all given archs
 
+        Returns a dict mapping (package, arch) to the list of status codes,
+        so all products of a project are checked with a single request.
         """
 
-        query = {'package': package, 'repository': repository, 'arch': arch}
+        query = ['repository=%s' % quote_plus(repository)]
+        query += ['package=%s' % quote_plus(package) for package in sorted(set(packages))]
+        query += ['arch=%s' % quote_plus(arch) for arch in sorted(set(archs))]
 
         url = self.api.makeurl(['build', project, '_result'], query)
         f = self.api.retried_GET(url)
         root = ET.parse(f).getroot()
-        # [@code!='succeeded'] is not supported by ET
-        failed = [status for status in root.findall('result/status') if status.get('code') != 'succeeded']
+
+        results = {}
+        for result in root.findall('result'):
+            for status in result.findall('status'):
+                key = (status.get('package'), result.get('arch'))
+                results.setdefault(key, []).append(status.get('code'))
+
+        return results
+
+    def package_ok(self, project, package, repository, arch, results=None):
+        """Checks one package in a project and returns True if it's succeeded
+
+        results can be passed from a previous build_results() call covering
+        the package, otherwise they are fetched.
+        """
+
+        if results is None:
+            results = self.build_results(project, repository, [package], [arch])
+        codes = results.get((package, arch), [])
+
+        failed = [code for code in codes if code != 'succeeded']
 
         if any(failed):
             self.logger.info(
-                '%s %s %s %s -> %s' % (project, package, repository, arch, failed[0].get('code')))
+                '%s %s %s %s -> %s' % (project, package, repository, arch, failed[0]))
             return False
 
-        if not len(root.findall('result/status[@code="succeeded"]')):
+        if not len(codes):
             self.logger.info('No "succeeded" for %s %s %s %s' % (project, package, repository, arch))
             return False
 
@@ -121,13 +145,9 @@ class ToTestReleaser(ToTestManager):
         if not maxsize:
             return True
 
-        url = self.api.makeurl(['build', project, repository, arch, package])
-        f = self.api.retried_GET(url)
-        root = ET.parse(f).getroot()
-        for binary in root.findall('binary'):
-            if not binary.get('filename', '').endswith('.iso'):
+        for filename, isosize in self.binary_list(project, package, repo=repository, arch=arch):
+            if not filename.endswith('.iso'):
                 continue
-            isosize = int(binary.get('size', 0))
             if isosize > maxsize:
                 self.logger.error('%s %s %s %s: %s' % (
                     project, package, repository, arch, 'too large by %s bytes' % (isosize - maxsize)))
@@ -135,6 +155,26 @@ class ToTestReleaser(ToTestManager):
 
         return True
 
+    def packages_ok(self, project, repository, products):
+        """Checks a list of (package, arch) tuples with a single _result query
+
+        The products are checked in order and the first failure stops the
+        check just like calling package_ok on each of them would.
+        """
+
+        if not len(products):
+            return True
+
+        packages = [package for package, _ in products]
+        archs = [arch for _, arch in products]
+        results = self.build_results(project, repository, packages, archs)
+
+        for package, arch in products:
+            if not self.package_ok(project, package, repository, arch, results=results):
+                return False
+
+        return True
+
     def is_snapshotable(self):
         """Check various conditions required for factory to be snapshotable
 
@@ -143,24 +183,28 @@ class ToTestReleaser(ToTestManager):
         if not self.all_repos_done(self.project.name):
             return False
 
+        products = []
         for product in self.project.ftp_products + self.project.main_products:
-            if not self.package_ok(self.project.name, product, self.project.product_repo, self.project.product_arch):
-                return False
+            products.append((product, self.project.product_arch))
 
         for product in self.project.image_products + self.project.container_products:
             for arch in product.archs:
-                if not self.package_ok(self.project.name, product.package, self.project.product_repo, arch):
-                    return False
+                products.append((product.package, arch))
+
+        if not self.packages_ok(self.project.name, self.project.product_repo, products):
+            return False
 
         if len(self.project.livecd_products):
             if not self.all_repos_done('%s:Live' % self.project.name):
                 return False
 
+            products = []
             for product in self.project.livecd_products:
                 for arch in product.archs:
-                    if not self.package_ok('%s:Live' % self.project.name, product.package,
-                                           self.project.product_repo, arch):
-                        return False
+                    products.append((product.package, arch))
+
+            if not self.packages_ok('%s:Live' % self.project.name, self.project.product_repo, products):
+                return False
 
         if self.project.need_same_build_number:
             # make sure all medias have the same build number